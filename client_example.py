@@ -5,6 +5,47 @@ import json
 import os
 import websockets
 import sys
+import threading
+
+try:
+    import orjson
+    dumps = orjson.dumps
+    loads = orjson.loads
+except ImportError:
+    def dumps(obj) -> bytes:
+        """Serialize to compact UTF-8 JSON bytes (stdlib fallback for orjson)"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+    loads = json.loads
+
+# Server-2 serializes output messages type first, then topicName, so they can
+# be recognized, and ones for other topics skipped, without parsing the frame
+OUTPUT_PREFIX = b'{"type":"output",'
+
+
+async def ainput(prompt=""):
+    """input() without blocking the event loop
+    
+    The read runs in a daemon thread so responses keep arriving while the
+    user types, and a prompt left unanswered never holds up exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
+            
+    def read():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, line)
+            
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
 
 class Program1Client:
     """Example Program-1 client that demonstrates the system"""
@@ -12,7 +53,30 @@ class Program1Client:
     def __init__(self, server2_url="ws://localhost:8082"):
         self.server2_url = server2_url
         self.websocket = None
-        self.current_topic = None
+        self.current_topic = None  # also sets topic_output_prefix
+        # Response type -> handler, looked up once per message
+        self.response_handlers = {
+            'topic_created': self._on_topic_created,
+            'topic_create_failed': self._on_topic_create_failed,
+            'topic_stopped': self._on_topic_stopped,
+            'command_sent': self._on_command_sent,
+            'output': self._on_output,
+            'batch': self._on_batch,
+        }
+        
+    @property
+    def current_topic(self):
+        """Topic whose output is shown"""
+        return self._current_topic
+        
+    @current_topic.setter
+    def current_topic(self, topic_name):
+        self._current_topic = topic_name
+        # Opening bytes of an output message for this topic
+        self.topic_output_prefix = (
+            OUTPUT_PREFIX + b'"topicName":' + dumps(topic_name) + b','
+            if topic_name is not None else None
+        )
         
     async def connect(self):
         """Connect to server-2"""
@@ -24,7 +88,8 @@ class Program1Client:
             self.websocket = await websockets.connect(
                 self.server2_url,
                 ping_interval=ping_interval,
-                ping_timeout=ping_timeout
+                ping_timeout=ping_timeout,
+                compression=None  # Output frames are small, deflate costs more than it saves
             )
             print(f"Connected to server-2 at {self.server2_url}")
             print(f"WebSocket timeout: ping_interval={ping_interval}s, ping_timeout={ping_timeout}s")
@@ -42,7 +107,14 @@ class Program1Client:
         try:
             async for message in self.websocket:
                 try:
-                    data = json.loads(message)
+                    # Fast path for the common case, a single output message:
+                    # only the current topic's output is parsed at all
+                    if isinstance(message, bytes) and message.startswith(OUTPUT_PREFIX):
+                        if self.topic_output_prefix and message.startswith(self.topic_output_prefix):
+                            await self._on_output(loads(message))
+                        continue
+                        
+                    data = loads(message)
                     await self.handle_response(data)
                 except json.JSONDecodeError:
                     print(f"Invalid response: {message}")
@@ -56,47 +128,60 @@ class Program1Client:
     async def handle_response(self, data):
         """Handle response from server-2"""
         response_type = data.get('type')
+        handler = self.response_handlers.get(response_type)
+        if handler:
+            await handler(data)
+        else:
+            print(f"Unknown response type: {response_type}")
+            
+    async def _on_topic_created(self, data):
+        """Topic creation result"""
+        topic_name = data.get('topicName')
+        success = data.get('success')
+        if success:
+            print(f"✓ Topic '{topic_name}' created successfully")
+            self.current_topic = topic_name
+        else:
+            print(f"✗ Failed to create topic '{topic_name}'")
+            
+    async def _on_topic_create_failed(self, data):
+        """Topic could not get a session"""
+        topic_name = data.get('topicName')
+        print(f"✗ Failed to create topic '{topic_name}' - невозможно создать сессию")
         
-        if response_type == 'topic_created':
-            topic_name = data.get('topicName')
-            success = data.get('success')
-            if success:
-                print(f"✓ Topic '{topic_name}' created successfully")
-                self.current_topic = topic_name
-            else:
-                print(f"✗ Failed to create topic '{topic_name}'")
-                
-        elif response_type == 'topic_create_failed':
-            topic_name = data.get('topicName')
-            print(f"✗ Failed to create topic '{topic_name}' - невозможно создать сессию")
+    async def _on_topic_stopped(self, data):
+        """Topic stop result"""
+        topic_name = data.get('topicName')
+        success = data.get('success')
+        if success:
+            print(f"✓ Topic '{topic_name}' stopped")
+            self.current_topic = None
+        else:
+            print(f"✗ Failed to stop topic '{topic_name}'")
             
-        elif response_type == 'topic_stopped':
-            topic_name = data.get('topicName')
-            success = data.get('success')
-            if success:
-                print(f"✓ Topic '{topic_name}' stopped")
-                self.current_topic = None
-            else:
-                print(f"✗ Failed to stop topic '{topic_name}'")
-                
-        elif response_type == 'command_sent':
-            topic_name = data.get('topicName')
-            command = data.get('command')
-            success = data.get('success')
-            if success:
-                print(f"✓ Command '{command}' sent to topic '{topic_name}'")
-            else:
-                print(f"✗ Failed to send command '{command}' to topic '{topic_name}'")
-
-        elif response_type == 'output':
-            topic_name = data.get('topicName')
-            output = data.get('data')
-            timestamp = data.get('timestamp', '')
-            if output and topic_name == self.current_topic:
-                # Display the output with a prefix to distinguish from local messages
-                print(f"📤 {output.strip()}")
+    async def _on_command_sent(self, data):
+        """Command delivery result"""
+        topic_name = data.get('topicName')
+        command = data.get('command')
+        success = data.get('success')
+        if success:
+            print(f"✓ Command '{command}' sent to topic '{topic_name}'")
         else:
-            print(f"Unknown response type: {response_type}")
+            print(f"✗ Failed to send command '{command}' to topic '{topic_name}'")
+            
+    async def _on_batch(self, data):
+        """Messages server-2 queued for us while the previous send was in flight"""
+        for item in data.get('items', []):
+            await self.handle_response(item)
+            
+    async def _on_output(self, data):
+        """Output from the current topic's session"""
+        topic_name = data.get('topicName')
+        output = data.get('data')
+        if output and topic_name == self.current_topic:
+            # Display the output with a prefix to distinguish from local messages;
+            # server-1 already trims trailing whitespace off each batch
+            sys.stdout.write(f"📤 {output}\n")
             
     async def create_topic(self, topic_name, user_id):
         """Create a new topic (implements use case 1)"""
@@ -110,7 +195,7 @@ class Program1Client:
             "userId": user_id
         }
         
-        await self.websocket.send(json.dumps(message))
+        await self.websocket.send(dumps(message))
         return True
         
     async def stop_topic(self, topic_name=None):
@@ -131,7 +216,7 @@ class Program1Client:
             "topicName": topic_name
         }
         
-        await self.websocket.send(json.dumps(message))
+        await self.websocket.send(dumps(message))
         return True
         
     async def send_command(self, command, topic_name=None):
@@ -153,7 +238,7 @@ class Program1Client:
             "command": command
         }
         
-        await self.websocket.send(json.dumps(message))
+        await self.websocket.send(dumps(message))
         return True
         
     async def run_interactive_session(self):
@@ -173,7 +258,7 @@ class Program1Client:
         
         while True:
             try:
-                user_input = input(f"[{self.current_topic or 'no-topic'}]> ").strip()
+                user_input = (await ainput(f"[{self.current_topic or 'no-topic'}]> ")).strip()
                 
                 if not user_input:
                     continue
@@ -181,8 +266,9 @@ class Program1Client:
                 if user_input.lower() == 'quit':
                     break
                     
-                if user_input.startswith('создать топик '):
-                    topic_name = user_input[14:].strip()
+                topic_name = user_input.removeprefix('создать топик ')
+                if topic_name != user_input:
+                    topic_name = topic_name.lstrip()
                     if topic_name:
                         await self.create_topic(topic_name, user_id)
                     else:
@@ -198,10 +284,7 @@ class Program1Client:
                     else:
                         print("No active topic. Create a topic first.")
                         
-                # Small delay to allow responses to be processed
-                await asyncio.sleep(0.1)
-                
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, asyncio.CancelledError):
                 print("\nExiting...")
                 break
             except EOFError:
@@ -258,6 +341,12 @@ async def main():
         await client.run_interactive_session()
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1,75 +1,311 @@
 #!/usr/bin/env python3
 
 import asyncio
+import codecs
 import subprocess
-import uuid
+import time
 import json
 import os
 import logging
-from datetime import datetime, timezone
-from typing import Dict, Optional
+import random
+import secrets
+import shutil
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Set, Tuple
 import websockets
+from aiohttp import web
 from websockets.exceptions import ConnectionClosed
 
+try:
+    import orjson
+    
+    dumps = orjson.dumps  # compact UTF-8 JSON bytes
+    loads = orjson.loads
+except ImportError:
+    def dumps(obj) -> bytes:
+        """Serialize to compact UTF-8 JSON bytes (stdlib fallback for orjson)"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+    loads = json.loads
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Output batching: raw pane chunks pending per session are coalesced into one
+# stdout_batch frame, bounded by chunk count and byte size
+OUTPUT_QUEUE_SIZE = 1000
+OUTPUT_BATCH_ITEMS = 100
+OUTPUT_BATCH_BYTES = 16 * 1024
+OUTPUT_READ_SIZE = 64 * 1024
+# After the first new output the flusher waits (seconds) so a burst such as a
+# command's echo, its output and the prompt goes out together; the wait grows
+# with the frames still queued for server-2, making batches bigger under load
+OUTPUT_FLUSH_MIN_DELAY = 0.02
+OUTPUT_FLUSH_DELAY_PER_FRAME = 0.01
+OUTPUT_FLUSH_MAX_DELAY = 0.5
+
+# Outbound frames to server-2 go through one writer task; frames already
+# queued when it wakes up are sent together in one batch message
+WS_QUEUE_SIZE = 5000
+WS_BATCH_BYTES = 64 * 1024
+WS_BATCH_PREFIX = b'{"type":"batch","items":['
+# Write buffer high-water mark, a few full batches, so send() doesn't wait
+# for the previous batch to drain before returning
+WS_WRITE_LIMIT = 4 * WS_BATCH_BYTES
+
+# Session scratch directories live on disk rather than in /tmp, which is
+# often RAM-backed tmpfs; past MAX_SESSIONS the least recently used is evicted
+SESSIONS_DIR = os.getenv('SESSIONS_DIR', '/var/lib/tmuxmgr/sessions')
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '100'))
+
+# Reconnects to server-2 back off exponentially up to this many seconds
+RECONNECT_MAX_DELAY = 60
+
+# Seconds between attempts to replace a lost tmux control client
+TMUX_CTL_RETRY_INTERVAL = 5
+
+# Formatted timestamps are reused until the clock moves past their resolution
+_utc_timestamp_cache: Tuple[int, str] = (0, "")  # (unix milliseconds, ISO 8601 UTC)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential reconnect delay, capped, with jitter so retries don't synchronize"""
+    return min(2 ** attempt, RECONNECT_MAX_DELAY) + random.random()
+
+
+def flush_delay(backlog: int) -> float:
+    """Output flush wait for a given number of frames queued to server-2"""
+    return min(OUTPUT_FLUSH_MIN_DELAY + OUTPUT_FLUSH_DELAY_PER_FRAME * backlog, OUTPUT_FLUSH_MAX_DELAY)
+
+
+def utc_timestamp() -> str:
+    """Current UTC time as ISO 8601 with milliseconds, formatted at most once per millisecond"""
+    global _utc_timestamp_cache
+    now_ms = time.time_ns() // 1_000_000
+    if now_ms != _utc_timestamp_cache[0]:
+        seconds, millis = divmod(now_ms, 1000)
+        formatted = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + f'.{millis:03d}Z'
+        _utc_timestamp_cache = (now_ms, formatted)
+    return _utc_timestamp_cache[1]
+
+
+def json_response(data, status: int = 200) -> web.Response:
+    """JSON HTTP response with the body serialized straight to bytes"""
+    return web.Response(body=dumps(data), status=status, content_type='application/json')
+
+
+def tmux_quote(arg: str) -> str:
+    """Quote an argument for the tmux command parser"""
+    escaped = (arg.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$')
+               .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'))
+    return f'"{escaped}"'
+
+
+class TmuxControlClient:
+    """Persistent tmux control-mode (-C) client
+    
+    Commands are written to one long-lived tmux client instead of forking a
+    new tmux process per call. tmux answers commands in order, each wrapped
+    in a %begin/%end (or %error) block.
+    """
+    
+    def __init__(self, session_name: str):
+        self.session_name = session_name
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.pending: Deque[asyncio.Future] = deque()  # commands awaiting their reply block
+        self.reader_task: Optional[asyncio.Task] = None
+        
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+        
+    async def start(self):
+        """Attach a control-mode client to the tmux session"""
+        self.process = await asyncio.create_subprocess_exec(
+            "tmux", "-C", "attach", "-t", self.session_name,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        self.reader_task = asyncio.create_task(self.read_replies())
+        
+        # Pane output is streamed through pipe-pane, don't echo it here too
+        try:
+            await self.command("refresh-client", "-f", "no-output")
+        except subprocess.CalledProcessError:
+            logger.debug("tmux does not support refresh-client -f, ignoring")
+            
+    async def command(self, *args: str) -> List[str]:
+        """Run a tmux command and return its output lines"""
+        if not self.running:
+            raise ConnectionError("tmux control client is not running")
+            
+        future = asyncio.get_running_loop().create_future()
+        # Queue and write without yielding in between so replies stay in order
+        self.pending.append(future)
+        line = " ".join(tmux_quote(arg) for arg in args)
+        self.process.stdin.write(f"{line}\n".encode())
+        await self.process.stdin.drain()
+        return await future
+        
+    async def read_replies(self):
+        """Match %begin/%end reply blocks to pending commands"""
+        block: Optional[List[str]] = None
+        
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            line = line.decode(errors='replace').rstrip('\n')
+            
+            if block is None:
+                # Flag 1 marks replies to our own commands; anything else
+                # outside a block is a notification
+                if line.startswith('%begin ') and line.split()[-1] == '1':
+                    block = []
+                continue
+                
+            if line.startswith(('%end ', '%error ')):
+                if not self.pending:
+                    # Nobody is waiting for this reply, e.g. a command
+                    # written before the reader attached; keep reading
+                    logger.warning(f"tmux reply without a pending command: {line}")
+                    block = None
+                    continue
+                future = self.pending.popleft()
+                if not future.done():
+                    if line.startswith('%end '):
+                        future.set_result(block)
+                    else:
+                        future.set_exception(
+                            subprocess.CalledProcessError(1, "tmux", output="\n".join(block))
+                        )
+                block = None
+            else:
+                block.append(line)
+                
+        # tmux went away, fail everything still waiting
+        while self.pending:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError("tmux control client exited"))
+        logger.warning("tmux control client exited")
+
+
+@dataclass(slots=True)
+class Session:
+    """A worker window with its tmux target and paths, built once at creation"""
+    window_name: str
+    tmux_target: str
+    session_dir: str
+    pipe_path: str
+
 
 class TmuxSessionManager:
     def __init__(self, session_name: str = "worker_sessions"):
         self.session_name = session_name
-        self.sessions: Dict[str, str] = {}  # session_id -> window_name
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()  # session_id -> session, least recently used first
         self.websocket = None
+        self.ws_queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)  # serialized frames
+        self.ws_connected = asyncio.Event()  # set while self.websocket is open
+        self.ws_lifecycle: Optional[asyncio.Task] = None  # connects, listens and reconnects
+        self.ws_writer: Optional[asyncio.Task] = None
+        self.tmux_ctl: Optional[TmuxControlClient] = None
+        self.tmux_ctl_lock = asyncio.Lock()  # one control client restart at a time
+        self.tmux_ctl_retry_at = 0.0  # loop time before which a lost client isn't restarted
         self.sequence = 0
         self.command_timestamps = {}  # session_id -> last command timestamp
+        self.pending_commands: Dict[str, List[str]] = {}  # session_id -> commands waiting on an in-flight send-keys
+        self.output_queues: Dict[str, asyncio.Queue] = {}  # session_id -> pending output
+        self.output_decoders: Dict[str, codecs.IncrementalDecoder] = {}  # session_id -> UTF-8 decoder
+        self.dirty_outputs: Set[str] = set()  # sessions with queued output not yet flushed
+        self.output_ready = asyncio.Event()  # set whenever a session is marked dirty
+        self.output_flusher: Optional[asyncio.Task] = None
+        self.output_pipes: Dict[str, Tuple[int, int]] = {}  # session_id -> (read fd, keepalive write fd)
+        self.paused_outputs: Set[str] = set()  # sessions whose pipe reader is paused on a full queue
+        self.frame_prefixes: Dict[str, bytes] = {}  # session_id -> cached stdout_batch frame prefix
+        self.command_handlers = {  # server-2 message type -> handler
+            'batch': self._on_batch,
+            'command': self._on_command,
+            'session_destroy': self._on_session_destroy,
+        }
         
     async def start(self):
         """Initialize tmux session and connect to server-2"""
         # Create main tmux session if it doesn't exist
+        result = await self._tmux_exec("has-session", "-t", self.session_name, check=False)
+        if result.returncode != 0:
+            # This may fork the tmux server, which can inherit our pipes (it
+            # does under uvloop) and keep them open, so don't wait on output
+            await self._tmux_exec("new-session", "-d", "-s", self.session_name,
+                                  capture_output=False)
+            
+        # One control-mode client carries all further tmux commands
         try:
-            subprocess.run(
-                ["tmux", "has-session", "-t", self.session_name], 
-                check=True, 
-                capture_output=True
-            )
-        except subprocess.CalledProcessError:
-            subprocess.run(
-                ["tmux", "new-session", "-d", "-s", self.session_name],
-                check=True
-            )
+            self.tmux_ctl = TmuxControlClient(self.session_name)
+            await self.tmux_ctl.start()
+        except Exception as e:
+            logger.warning(f"tmux control mode unavailable, using one-shot tmux calls: {e}")
+            self.tmux_ctl = None
         
         # Connect to server-2 WebSocket
         await self.connect_websocket()
         
     async def connect_websocket(self):
-        """Connect to server-2 WebSocket"""
+        """Start the server-2 connection task, unless it is already running"""
+        if self.ws_lifecycle is None or self.ws_lifecycle.done():
+            self.ws_lifecycle = asyncio.create_task(self.run_websocket())
+            
+    async def run_websocket(self):
+        """Keep a connection to server-2 up: connect, listen until closed, reconnect"""
         server2_url = os.getenv('SERVER2_URL', 'ws://localhost:8003/ws')
-        max_retries = 5
-        retry_delay = 2
+        # Same keepalive settings as server-2 and the client; the library's
+        # 20s defaults drop idle links behind NAT and load balancers
+        ping_interval = int(os.getenv('WS_PING_INTERVAL', '300'))  # 5 minutes
+        ping_timeout = int(os.getenv('WS_PING_TIMEOUT', '60'))     # 1 minute
+        attempt = 0
         
-        for attempt in range(max_retries):
+        while True:
             try:
-                self.websocket = await websockets.connect(server2_url)
-                logger.info(f"Connected to server-2 at {server2_url}")
+                # Output frames are small and frequent, deflate costs more
+                # CPU and per-connection zlib memory than it saves
+                self.websocket = await websockets.connect(
+                    server2_url,
+                    ping_interval=ping_interval,
+                    ping_timeout=ping_timeout,
+                    compression=None,
+                    write_limit=WS_WRITE_LIMIT
+                )
+            except Exception as e:
+                delay = backoff_delay(attempt)
+                logger.warning(f"Connection attempt {attempt + 1} failed: {e}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
                 
-                # Start listening for messages
-                asyncio.create_task(self.listen_for_messages())
-                break
+            logger.info(f"Connected to server-2 at {server2_url}")
+            attempt = 0
+            self.ws_connected.set()
+            
+            # The writer outlives reconnects, it always sends on the current socket
+            if self.ws_writer is None or self.ws_writer.done():
+                self.ws_writer = asyncio.create_task(self.write_frames())
                 
-            except Exception as e:
-                logger.warning(f"Connection attempt {attempt + 1} failed: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay)
-                else:
-                    logger.error("Failed to connect to server-2 after all retries")
-                    raise
+            try:
+                await self.listen_for_messages()
+            finally:
+                self.ws_connected.clear()
+                
+            # Reconnect, jittered so a flapping server-2 isn't hammered
+            logger.warning("WebSocket connection closed")
+            await asyncio.sleep(backoff_delay(0))
                     
     async def listen_for_messages(self):
-        """Listen for commands from server-2"""
+        """Listen for commands from server-2 until the connection closes"""
         try:
             async for message in self.websocket:
                 try:
-                    data = json.loads(message)
+                    data = loads(message)
                     await self.handle_command(data)
                 except json.JSONDecodeError:
                     logger.error(f"Invalid JSON received: {message}")
@@ -77,226 +313,356 @@ class TmuxSessionManager:
                     logger.error(f"Error handling message: {e}")
                     
         except ConnectionClosed:
-            logger.warning("WebSocket connection closed")
-            # Try to reconnect
-            await asyncio.sleep(2)
-            await self.connect_websocket()
+            pass
             
     async def handle_command(self, data: dict):
         """Handle command from server-2"""
-        command_type = data.get('type')
+        handler = self.command_handlers.get(data.get('type'))
+        if handler:
+            await handler(data)
+            
+    async def _on_batch(self, data: dict):
+        """Server-2 coalesces queued messages into one batch message; handle them in order"""
+        for item in data.get('items', []):
+            await self.handle_command(item)
+            
+    async def _on_command(self, data: dict):
+        """Run a command in a session"""
         session_id = data.get('sessionId')
         command = data.get('data')
-        
-        if command_type == 'command' and session_id and command:
+        if session_id and command:
             await self.send_command_to_session(session_id, command)
-        elif command_type == 'session_destroy' and session_id:
+            
+    async def _on_session_destroy(self, data: dict):
+        """Destroy a session on request"""
+        session_id = data.get('sessionId')
+        if session_id:
             await self.destroy_session(session_id)
             
+    async def _tmux_exec(self, *args: str, check: bool = True,
+                         capture_output: bool = True) -> subprocess.CompletedProcess:
+        """Run a one-shot tmux process without blocking the event loop"""
+        stream = asyncio.subprocess.PIPE if capture_output else asyncio.subprocess.DEVNULL
+        proc = await asyncio.create_subprocess_exec(
+            "tmux", *args,
+            stdout=stream,
+            stderr=stream
+        )
+        stdout, stderr = await proc.communicate()
+        
+        if check and proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, ["tmux", *args], stdout, stderr)
+        return subprocess.CompletedProcess(["tmux", *args], proc.returncode, stdout, stderr)
+        
+    async def _tmux(self, *args: str) -> List[str]:
+        """Run a tmux command, over the control client when it is up"""
+        if self.tmux_ctl and not self.tmux_ctl.running:
+            await self.restart_tmux_ctl()
+            
+        if self.tmux_ctl and self.tmux_ctl.running:
+            try:
+                return await self.tmux_ctl.command(*args)
+            except ConnectionError:
+                logger.warning("tmux control client lost, falling back to a one-shot tmux call")
+                
+        result = await self._tmux_exec(*args)
+        return result.stdout.decode(errors='replace').splitlines()
+        
+    async def restart_tmux_ctl(self):
+        """Replace a lost control client, so commands don't stay on one-shot calls"""
+        loop = asyncio.get_running_loop()
+        async with self.tmux_ctl_lock:
+            if self.tmux_ctl.running or loop.time() < self.tmux_ctl_retry_at:
+                return
+            self.tmux_ctl_retry_at = loop.time() + TMUX_CTL_RETRY_INTERVAL
+            
+            tmux_ctl = TmuxControlClient(self.session_name)
+            try:
+                await tmux_ctl.start()
+            except Exception as e:
+                logger.warning(f"Failed to restart tmux control client: {e}")
+                return
+            self.tmux_ctl = tmux_ctl
+            logger.info("tmux control client restarted")
+            
+    def make_session(self, session_id: str, window_name: str) -> Session:
+        """Build a session record with its tmux target and paths precomputed"""
+        session_dir = f"{SESSIONS_DIR}/{session_id}"
+        return Session(
+            window_name=window_name,
+            tmux_target=f"{self.session_name}:{window_name}",
+            session_dir=session_dir,
+            pipe_path=f"{session_dir}/out.pipe"
+        )
+        
     async def create_session(self, user_id: str) -> str:
         """Create a new tmux session"""
-        session_id = str(uuid.uuid4())
-        window_name = f"worker-{session_id[:8]}"
+        session_id = secrets.token_hex(16)
+        session = self.make_session(session_id, f"worker-{session_id[:8]}")
         
+        if len(self.sessions) >= MAX_SESSIONS:
+            oldest = next(iter(self.sessions))
+            logger.warning(f"Session limit {MAX_SESSIONS} reached, evicting least recently used session {oldest}")
+            if await self.destroy_session(oldest):
+                # Server-2 didn't ask for this one, tell it the session is gone
+                await self.ws_queue.put(dumps({
+                    "type": "session_destroyed",
+                    "sessionId": oldest,
+                    "timestamp": utc_timestamp()
+                }))
+            else:
+                logger.error(f"Failed to evict session {oldest}, now over the limit of {MAX_SESSIONS} sessions")
+            
         try:
             # Create directory for session
-            os.makedirs(f"/tmp/sessions/{session_id}", exist_ok=True)
+            os.makedirs(session.session_dir, exist_ok=True)
             
             # Create new tmux window
-            subprocess.run([
-                "tmux", "new-window", 
+            await self._tmux(
+                "new-window",
                 "-t", self.session_name,
-                "-n", window_name,
+                "-n", session.window_name,
                 "bash"  # Start with bash shell
-            ], check=True)
-            
-            # Send initial start command
-            await self.send_command_to_window(window_name, 'echo "старт"')
+            )
             
             # Store session
-            self.sessions[session_id] = window_name
+            self.sessions[session_id] = session
+            
+            # Set up output batching before anything can produce output
+            self.frame_prefixes[session_id] = self.frame_prefix(session_id)
+            self.output_queues[session_id] = asyncio.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+            # Incremental decoding keeps multi-byte characters split across batches intact
+            self.output_decoders[session_id] = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            # One flusher serves every session
+            if self.output_flusher is None or self.output_flusher.done():
+                self.output_flusher = asyncio.create_task(self.flush_output())
             
-            # Start monitoring this session
-            asyncio.create_task(self.monitor_session_output(session_id))
+            # Stream pane output before the first command so nothing is missed
+            await self.start_output_pipe(session_id)
+            
+            # Send initial start command
+            await self.send_command_to_window(session.tmux_target, 'echo "старт"')
             
             logger.info(f"Created session {session_id} for user {user_id}")
             return session_id
             
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             logger.error(f"Failed to create tmux session: {e}")
+            if session_id in self.sessions:
+                await self.destroy_session(session_id)
+            else:
+                # No window yet, only the directory to clean up
+                shutil.rmtree(session.session_dir, ignore_errors=True)
             raise Exception("Failed to create session")
             
     async def send_command_to_session(self, session_id: str, command: str):
         """Send command to specific session"""
-        window_name = self.sessions.get(session_id)
-        if not window_name:
+        session = self.sessions.get(session_id)
+        if not session:
             logger.error(f"Session {session_id} not found")
             return
+        self.sessions.move_to_end(session_id)
             
         # Track when we send commands to better handle output
-        import time
         self.command_timestamps[session_id] = time.time()
+        
+        # Commands arriving while a send-keys is in flight ride along on the next one
+        pending = self.pending_commands.get(session_id)
+        if pending is not None:
+            pending.append(command)
+            return
             
-        await self.send_command_to_window(window_name, command)
+        self.pending_commands[session_id] = pending = [command]
+        try:
+            while pending:
+                commands = pending[:]
+                pending.clear()
+                await self.send_command_to_window(session.tmux_target, *commands)
+        finally:
+            del self.pending_commands[session_id]
         
-    async def send_command_to_window(self, window_name: str, command: str):
-        """Send command to tmux window"""
+    async def send_command_to_window(self, target: str, *commands: str):
+        """Send commands to tmux window target (session:window), each followed by Enter"""
+        keys = []
+        for command in commands:
+            keys += (command, "Enter")
+            
         try:
-            subprocess.run([
-                "tmux", "send-keys",
-                "-t", f"{self.session_name}:{window_name}",
-                command, "Enter"
-            ], check=True)
+            await self._tmux(
+                "send-keys",
+                "-t", target,
+                *keys
+            )
         except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to send command to {window_name}: {e}")
+            logger.error(f"Failed to send command to {target}: {e}")
             
-    async def monitor_session_output(self, session_id: str):
-        """Monitor output from a tmux session using pipe-pane for better accuracy"""
-        import time
-        import os
-        import aiofiles
+    async def start_output_pipe(self, session_id: str):
+        """Pipe pane output into a FIFO and read it as soon as it arrives"""
+        session = self.sessions[session_id]
+        
+        os.mkfifo(session.pipe_path)
+        read_fd = os.open(session.pipe_path, os.O_RDONLY | os.O_NONBLOCK)
+        # Keep our own write end open so the reader never sees EOF
+        # while no pipe-pane writer is attached
+        write_fd = os.open(session.pipe_path, os.O_WRONLY | os.O_NONBLOCK)
         
-        window_name = self.sessions.get(session_id)
-        if not window_name:
+        self.output_pipes[session_id] = (read_fd, write_fd)
+        asyncio.get_running_loop().add_reader(read_fd, self.read_session_output, session_id)
+        
+        await self._tmux(
+            "pipe-pane",
+            "-t", session.tmux_target,
+            "-o", f"cat >> {session.pipe_path}"
+        )
+        logger.info(f"Started pipe-pane for session {session_id}")
+        
+    def stop_output_pipe(self, session_id: str):
+        """Stop reading a session's output FIFO and close it"""
+        fds = self.output_pipes.pop(session_id, None)
+        if fds:
+            asyncio.get_running_loop().remove_reader(fds[0])
+            for fd in fds:
+                os.close(fd)
+        self.paused_outputs.discard(session_id)
+        
+    def read_session_output(self, session_id: str):
+        """Reader callback: queue newly piped output for the flusher"""
+        read_fd = self.output_pipes[session_id][0]
+        queue = self.output_queues[session_id]
+        
+        if queue.full():
+            # Stop reading until the sender catches up; the FIFO and tmux buffer meanwhile
+            asyncio.get_running_loop().remove_reader(read_fd)
+            self.paused_outputs.add(session_id)
             return
             
-        # Create a unique log file for this session
-        log_file = f"/tmp/sessions/{session_id}/output.log"
-        
         try:
-            # Start tmux pipe-pane to capture all output to file
-            subprocess.run([
-                "tmux", "pipe-pane",
-                "-t", f"{self.session_name}:{window_name}",
-                "-o", f"cat >> {log_file}"
-            ], check=True)
-            logger.info(f"Started pipe-pane for session {session_id}")
-            
-            last_position = 0
-            last_send_time = 0
-            min_send_interval = 0.2  # Reduced interval for better responsiveness
-            
-            while session_id in self.sessions:
-                try:
-                    current_time = time.time()
+            data = os.read(read_fd, OUTPUT_READ_SIZE)
+        except BlockingIOError:
+            return
+            
+        # Raw bytes only; decoding is done once per batch by the flusher
+        if data:
+            queue.put_nowait(data)
+            self.dirty_outputs.add(session_id)
+            self.output_ready.set()
+            
+    async def flush_output(self):
+        """Send each dirty session's pending output chunks as one batch"""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            await self.output_ready.wait()
+            await asyncio.sleep(flush_delay(self.ws_queue.qsize()))
+            self.output_ready.clear()
+            dirty, self.dirty_outputs = self.dirty_outputs, set()
+            
+            for session_id in dirty:
+                queue = self.output_queues.get(session_id)
+                if queue is None:
+                    continue  # destroyed since it was marked
+                decoder = self.output_decoders[session_id]
                     
-                    # Read new content from the log file
-                    if os.path.exists(log_file):
-                        async with aiofiles.open(log_file, 'r') as f:
-                            await f.seek(last_position)
-                            new_content = await f.read()
-                            
-                            if new_content.strip() and (current_time - last_send_time) > min_send_interval:
-                                # Send only the new content
-                                await self.send_output_to_server2(session_id, new_content.rstrip())
-                                last_position = await f.tell()
-                                last_send_time = current_time
+                # Coalesce what is pending, up to the batch limits
+                chunks = []
+                batch_size = 0
+                while (not queue.empty() and 
+                       len(chunks) < OUTPUT_BATCH_ITEMS and 
+                       batch_size < OUTPUT_BATCH_BYTES):
+                    chunk = queue.get_nowait()
+                    chunks.append(chunk)
+                    batch_size += len(chunk)
                     
-                    await asyncio.sleep(0.1)  # Faster polling for better responsiveness
+                # Over the limits, the rest goes out on the next pass
+                if not queue.empty():
+                    self.dirty_outputs.add(session_id)
+                    self.output_ready.set()
                     
-                except Exception as e:
-                    logger.error(f"Error reading output file for session {session_id}: {e}")
-                    await asyncio.sleep(0.5)
+                # Room again in the queue, resume a paused pipe reader
+                if session_id in self.paused_outputs:
+                    self.paused_outputs.discard(session_id)
+                    loop.add_reader(
+                        self.output_pipes[session_id][0], self.read_session_output, session_id
+                    )
                     
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to start pipe-pane for session {session_id}: {e}")
-            # Fallback to capture-pane method
-            await self._fallback_monitor_session_output(session_id)
-        except Exception as e:
-            logger.error(f"Error in pipe-pane monitoring for session {session_id}: {e}")
-        finally:
-            # Clean up pipe-pane
-            try:
-                subprocess.run([
-                    "tmux", "pipe-pane",
-                    "-t", f"{self.session_name}:{window_name}",
-                    "-k"  # Kill the pipe-pane
-                ], check=False)  # Don't fail if this doesn't work
-            except:
-                pass
-                
-    async def _fallback_monitor_session_output(self, session_id: str):
-        """Fallback method using capture-pane if pipe-pane fails"""
-        import time
-        
-        window_name = self.sessions.get(session_id)
-        if not window_name:
-            return
-            
-        last_output = ""
-        last_send_time = 0
-        min_send_interval = 0.3
-        
-        while session_id in self.sessions:
-            try:
-                result = subprocess.run([
-                    "tmux", "capture-pane",
-                    "-t", f"{self.session_name}:{window_name}",
-                    "-p"
-                ], capture_output=True, text=True, check=True)
-                
-                current_output = result.stdout.rstrip()
-                current_time = time.time()
-                
-                if (current_output != last_output and 
-                    current_output.strip() and 
-                    (current_time - last_send_time) > min_send_interval):
+                # The pane stream is contiguous, so decode and trim it as one piece
+                output = decoder.decode(b"".join(chunks)).rstrip()
+                if output:
+                    items = [{"timestamp": utc_timestamp(), "data": output}]
+                    await self.send_output_to_server2(session_id, items)
                     
-                    await self.send_output_to_server2(session_id, current_output)
-                    last_output = current_output
-                    last_send_time = current_time
-                
-                await asyncio.sleep(0.3)
-                
-            except subprocess.CalledProcessError:
-                break
-            except Exception as e:
-                logger.error(f"Error in fallback monitoring for session {session_id}: {e}")
-                break
-                
-    async def send_output_to_server2(self, session_id: str, output: str):
-        """Send session output to server-2"""
-        if not self.websocket:
+    @staticmethod
+    def frame_prefix(session_id: str) -> bytes:
+        """Serialized opening of a session's stdout_batch frame, up to the first per-batch key"""
+        return dumps({"type": "stdout_batch", "sessionId": session_id})[:-1] + b','
+        
+    async def send_output_to_server2(self, session_id: str, items: list):
+        """Send a batch of session output to server-2"""
+        if not self.websocket or not items:
             return
             
-        message = {
-            "type": "stdout",
-            "sessionId": session_id,
-            "timestamp": datetime.now(timezone.utc).isoformat() + 'Z',
-            "data": output,
-            "sequence": self.sequence
-        }
+        # Only the per-batch fields are serialized; type and sessionId come
+        # from the cached prefix
+        prefix = self.frame_prefixes.get(session_id) or self.frame_prefix(session_id)
+        frame = prefix + dumps({"items": items, "sequence": self.sequence})[1:]
         
         self.sequence += 1
         
-        try:
-            await self.websocket.send(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Failed to send output to server-2: {e}")
+        # Waits when the writer falls behind, which backs up into the session queues
+        await self.ws_queue.put(frame)
+        
+    async def write_frames(self):
+        """Single writer for server-2: send queued frames, coalescing pending ones"""
+        while True:
+            frames = [await self.ws_queue.get()]
+            batch_size = len(frames[0])
+            
+            while not self.ws_queue.empty() and batch_size < WS_BATCH_BYTES:
+                frame = self.ws_queue.get_nowait()
+                frames.append(frame)
+                batch_size += len(frame)
+                
+            # Frames are serialized JSON objects, joined they make the items array
+            if len(frames) == 1:
+                payload = frames[0]
+            else:
+                payload = WS_BATCH_PREFIX + b",".join(frames) + b"]}"
+            
+            # While disconnected the payload is held here; the queue fills up
+            # and the flusher, then the pipe readers, wait for the reconnect
+            while True:
+                await self.ws_connected.wait()
+                websocket = self.websocket
+                try:
+                    # Bytes go out as a binary frame, no str round-trip needed
+                    await websocket.send(payload)
+                    break
+                except ConnectionClosed:
+                    # Resend on the next connection, unless that one is already up
+                    if self.websocket is websocket:
+                        self.ws_connected.clear()
+                except Exception as e:
+                    logger.error(f"Failed to send output to server-2: {e}")
+                    break
             
     async def destroy_session(self, session_id: str) -> bool:
         """Destroy a tmux session"""
-        window_name = self.sessions.get(session_id)
-        if not window_name:
+        session = self.sessions.get(session_id)
+        if not session:
             logger.error(f"Session {session_id} not found")
             return False
             
         try:
-            # Stop pipe-pane for this window first
-            try:
-                subprocess.run([
-                    "tmux", "pipe-pane",
-                    "-t", f"{self.session_name}:{window_name}",
-                    "-k"  # Kill the pipe-pane
-                ], check=False)  # Don't fail if this doesn't work
-            except:
-                pass
-                
-            # Kill tmux window
-            subprocess.run([
-                "tmux", "kill-window",
-                "-t", f"{self.session_name}:{window_name}"
-            ], check=True)
+            # Kill tmux window; this closes tmux's end of the pipe, so no
+            # separate pipe-pane call is needed
+            await self._tmux(
+                "kill-window",
+                "-t", session.tmux_target
+            )
+            
+            # Only once the window is gone stop reading its output; if the
+            # kill fails the session stays alive and keeps streaming
+            self.stop_output_pipe(session_id)
             
             # Remove from sessions
             del self.sessions[session_id]
@@ -304,10 +670,15 @@ class TmuxSessionManager:
             # Clean up command tracking
             if session_id in self.command_timestamps:
                 del self.command_timestamps[session_id]
+                
+            # Drop pending output
+            self.output_queues.pop(session_id, None)
+            self.output_decoders.pop(session_id, None)
+            self.dirty_outputs.discard(session_id)
+            self.frame_prefixes.pop(session_id, None)
             
             # Clean up session directory
-            import shutil
-            shutil.rmtree(f"/tmp/sessions/{session_id}", ignore_errors=True)
+            shutil.rmtree(session.session_dir, ignore_errors=True)
             
             logger.info(f"Destroyed session {session_id}")
             return True
@@ -322,57 +693,42 @@ class TmuxHTTPServer:
         self.tmux_manager = tmux_manager
         self.port = port
         
-    async def handle_request(self, request):
-        """Handle HTTP requests"""
-        from aiohttp import web
-        
-        if request.method == 'POST' and request.path == '/sessions':
-            return await self.create_session(request)
-        elif request.method == 'DELETE' and request.path.startswith('/sessions/'):
-            session_id = request.path.split('/')[-1]
-            return await self.delete_session(session_id)
-        else:
-            return web.Response(status=404, text="Not found")
-            
     async def create_session(self, request):
         """Handle session creation"""
-        from aiohttp import web
-        
         try:
             data = await request.json()
             user_id = data.get('user_id')
             
             if not user_id:
-                return web.json_response({'error': 'user_id required'}, status=400)
+                return json_response({'error': 'user_id required'}, status=400)
                 
             session_id = await self.tmux_manager.create_session(user_id)
             
             response_data = {
                 'session_id': session_id,
-                'created_at': datetime.now(timezone.utc).isoformat() + 'Z',
+                'created_at': utc_timestamp(),
                 'websocket_endpoint': f'ws://server2:8000/ws/{session_id}',
                 'websocket_token': 'dummy_token'
             }
             
-            return web.json_response(response_data, status=201)
+            return json_response(response_data, status=201)
             
         except Exception as e:
             logger.error(f"Error creating session: {e}")
-            return web.json_response({'error': 'Failed to create session'}, status=422)
+            return json_response({'error': 'Failed to create session'}, status=422)
             
-    async def delete_session(self, session_id: str):
+    async def delete_session(self, request):
         """Handle session deletion"""
-        from aiohttp import web
-        
+        session_id = request.match_info['session_id']
         try:
             success = await self.tmux_manager.destroy_session(session_id)
             if success:
                 return web.Response(status=204)
             else:
-                return web.json_response({'error': 'Session not found'}, status=404)
+                return json_response({'error': 'Session not found'}, status=404)
         except Exception as e:
             logger.error(f"Error deleting session: {e}")
-            return web.json_response({'error': 'Internal error'}, status=500)
+            return json_response({'error': 'Internal error'}, status=500)
 
 
 async def main():
@@ -384,7 +740,6 @@ async def main():
     await tmux_manager.start()
     
     # Start HTTP server
-    from aiohttp import web
     app = web.Application()
     app.router.add_post('/sessions', http_server.create_session)
     app.router.add_delete('/sessions/{session_id}', http_server.delete_session)
@@ -407,4 +762,10 @@ async def main():
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     asyncio.run(main())
\ No newline at end of file
@@ -4,15 +4,91 @@ import asyncio
 import json
 import logging
 import os
-from datetime import datetime, timezone
-from typing import Dict, Set, Optional
+import time
+from typing import Dict, List, Set, Optional, TextIO, Tuple, Union
 import websockets
 from websockets.exceptions import ConnectionClosed
-import aiofiles
+import aiohttp
+
+try:
+    import orjson
+    
+    dumps = orjson.dumps  # compact UTF-8 JSON bytes
+    loads = orjson.loads
+except ImportError:
+    def dumps(obj) -> bytes:
+        """Serialize to compact UTF-8 JSON bytes (stdlib fallback for orjson)"""
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+    loads = json.loads
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Largest message accepted from server-1 (the library default is 1 MiB)
+SERVER1_MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+
+# Commands and destroy requests to server-1 go through one queue and writer
+# task, so they are sent in order without a send per request handler; ones
+# queued while a send is in flight go out together in one batch message.
+# A full queue makes the requesting handler wait rather than lose a command,
+# and while server-1 is reconnecting the writer holds on to what it has
+SERVER1_QUEUE_SIZE = 10000
+SERVER1_BATCH_ITEMS = 64
+
+# Seconds an idle HTTP connection to server-1 is kept for reuse
+HTTP_KEEPALIVE_TIMEOUT = 60
+
+# Output to each client goes through its own queue and sender task; messages
+# queued while a send is in flight go out together in one batch message.
+# When a slow client lets its queue fill, the oldest output is dropped;
+# replies to its requests share the queue but are never dropped
+CLIENT_QUEUE_SIZE = 1024
+CLIENT_BATCH_BYTES = 64 * 1024
+
+# Write buffer high-water mark, a few full batches, so send() doesn't wait
+# for the previous batch to drain before returning (same as server-1's)
+WS_WRITE_LIMIT = 4 * CLIENT_BATCH_BYTES
+
+# Opening of a batch message, for server-1 and clients alike
+BATCH_PREFIX = b'{"type":"batch","items":['
+# Opening of every output message to a client, see output_prefix
+OUTPUT_PREFIX = b'{"type":"output",'
+
+# Replies to client requests; the holes take already serialized JSON values.
+# They go through the client's queue like its output, so they keep their place
+TOPIC_REPLY = b'{"type":"%s","topicName":%s,"success":%s}'
+COMMAND_REPLY = b'{"type":"command_sent","topicName":%s,"command":%s,"success":%s}'
+
+# Topic log lines are buffered in memory and appended in one batch per
+# topic every LOG_FLUSH_INTERVAL seconds, off the event loop, to a log
+# file kept open for the topic's lifetime
+LOG_FLUSH_INTERVAL = 0.25
+LOG_FILE_BUFFERING = 64 * 1024
+
+# Formatted timestamps are reused until the clock moves past their resolution
+_utc_timestamp_cache: Tuple[int, str] = (0, "")  # (unix milliseconds, ISO 8601 UTC)
+_log_timestamp_cache: Tuple[int, str] = (0, "")  # (unix seconds, local log time)
+
+
+def utc_timestamp() -> str:
+    """Current UTC time as ISO 8601 with milliseconds, formatted at most once per millisecond"""
+    global _utc_timestamp_cache
+    now_ms = time.time_ns() // 1_000_000
+    if now_ms != _utc_timestamp_cache[0]:
+        seconds, millis = divmod(now_ms, 1000)
+        formatted = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + f'.{millis:03d}Z'
+        _utc_timestamp_cache = (now_ms, formatted)
+    return _utc_timestamp_cache[1]
+
+
+def log_timestamp() -> str:
+    """Current local time for topic log lines, formatted at most once per second"""
+    global _log_timestamp_cache
+    now = int(time.time())
+    if now != _log_timestamp_cache[0]:
+        _log_timestamp_cache = (now, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+    return _log_timestamp_cache[1]
+
 
 class Program2Interface:
     """Interface for Program-2 to interact with the system"""
@@ -20,15 +96,25 @@ class Program2Interface:
     def __init__(self, websocket_router):
         self.websocket_router = websocket_router
         self.topics: Dict[str, str] = {}  # topic_name -> session_id
+        self.sessions: Dict[str, str] = {}  # session_id -> topic_name, for output routing
         self.topic_owners: Dict[str, object] = {}  # topic_name -> client websocket
+        self.output_prefixes: Dict[str, bytes] = {}  # topic_name -> cached output message prefix
+        self.topics_dir = f"{os.getenv('DATA_DIR', './data')}/topics"
+        self.log_paths: Dict[str, str] = {}  # topic_name -> log file path
+        self.topic_dirs: Set[str] = set()  # topic directories known to exist
+        self.log_buffers: Dict[str, List[str]] = {}  # topic_name -> log lines not yet written
+        self.log_flusher: Optional[asyncio.Task] = None
+        self.log_files: Dict[str, TextIO] = {}  # topic_name -> open log file
+        self.log_lock = asyncio.Lock()  # one batch of log writes at a time
         
     async def create_topic(self, topic_name: str, user_id: str, client_websocket=None) -> bool:
         """Create a new topic and start a session"""
         try:
-            # Create topic directory
-            data_dir = os.getenv('DATA_DIR', './data')
-            topic_dir = f"{data_dir}/topics/{topic_name}"
-            os.makedirs(topic_dir, exist_ok=True)
+            # Create topic directory, off the event loop and only once per name
+            topic_dir = f"{self.topics_dir}/{topic_name}"
+            if topic_dir not in self.topic_dirs:
+                await asyncio.to_thread(os.makedirs, topic_dir, exist_ok=True)
+                self.topic_dirs.add(topic_dir)
             
             # Request session creation from server-1
             session_id = await self.websocket_router.request_session_creation(user_id)
@@ -36,6 +122,9 @@ class Program2Interface:
             if session_id:
                 # Store topic mapping
                 self.topics[topic_name] = session_id
+                self.sessions[session_id] = topic_name
+                self.log_paths[topic_name] = f"{topic_dir}/{topic_name}.log"
+                self.output_prefixes[topic_name] = self.output_prefix(topic_name)
                 
                 # Store the client that owns this topic
                 if client_websocket:
@@ -65,15 +154,11 @@ class Program2Interface:
             # Request session destruction
             await self.websocket_router.request_session_destruction(session_id)
             
-            # Log session stopped
+            # Log session stopped, the last line before the log file is closed
             await self.log_to_topic(topic_name, "стоп")
+            await self.close_log(topic_name)
             
-            # Remove from topics
-            del self.topics[topic_name]
-            
-            # Clean up client ownership
-            if topic_name in self.topic_owners:
-                del self.topic_owners[topic_name]
+            self.forget_topic(topic_name, session_id)
             
             logger.info(f"Stopped topic {topic_name}")
             return True
@@ -82,6 +167,30 @@ class Program2Interface:
             logger.error(f"Error stopping topic {topic_name}: {e}")
             return False
             
+    async def handle_session_destroyed(self, session_id: str):
+        """Drop the topic of a session server-1 destroyed on its own and tell its owner"""
+        topic_name = self.sessions.get(session_id)
+        if not topic_name:
+            return
+            
+        owner_client = self.topic_owners.get(topic_name)
+        await self.log_to_topic(topic_name, "стоп")
+        await self.close_log(topic_name)
+        self.forget_topic(topic_name, session_id)
+        logger.info(f"Topic {topic_name} stopped, its session {session_id} was destroyed")
+        
+        if owner_client:
+            self.websocket_router.queue_to_client(
+                owner_client, TOPIC_REPLY % (b'topic_stopped', dumps(topic_name), b'true')
+            )
+            
+    def forget_topic(self, topic_name: str, session_id: str):
+        """Remove a stopped topic from the routing tables"""
+        self.topics.pop(topic_name, None)
+        self.sessions.pop(session_id, None)
+        self.topic_owners.pop(topic_name, None)
+        self.output_prefixes.pop(topic_name, None)
+        
     async def send_command_to_topic(self, topic_name: str, command: str) -> bool:
         """Send a command to a topic's session"""
         session_id = self.topics.get(topic_name)
@@ -104,13 +213,7 @@ class Program2Interface:
             
     async def handle_session_output(self, session_id: str, output: str):
         """Handle output from a session"""
-        # Find topic for this session
-        topic_name = None
-        for topic, sid in self.topics.items():
-            if sid == session_id:
-                topic_name = topic
-                break
-                
+        topic_name = self.sessions.get(session_id)
         if topic_name:
             await self.log_to_topic(topic_name, f"OUTPUT: {output}")
             logger.info(f"Logged output for topic {topic_name}: {output[:100]}...")
@@ -127,45 +230,129 @@ class Program2Interface:
         if not owner_client:
             return
             
-        # Create output message for the owner client
-        message = {
-            "type": "output",
-            "topicName": topic_name,
-            "data": output,
-            "timestamp": datetime.now().isoformat()
-        }
+        # Create output message for the owner client; only the per-message
+        # fields are serialized, type and topicName come from the cached prefix
+        prefix = self.output_prefixes.get(topic_name) or self.output_prefix(topic_name)
+        message = prefix + dumps({"data": output, "timestamp": utc_timestamp()})[1:]
         
-        try:
-            await owner_client.send(json.dumps(message))
-            logger.debug(f"Sent output to owner of topic {topic_name}")
-        except Exception as e:
-            logger.warning(f"Failed to send output to topic owner: {e}")
+        if not self.websocket_router.queue_to_client(owner_client, message):
+            logger.warning(f"Owner of topic {topic_name} is disconnected")
             # Remove the disconnected client
             del self.topic_owners[topic_name]
             
-    async def log_to_topic(self, topic_name: str, message: str):
-        """Log a message to topic's log file"""
-        try:
-            data_dir = os.getenv('DATA_DIR', './data')
-            log_file = f"{data_dir}/topics/{topic_name}/{topic_name}.log"
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_entry = f"{timestamp} - {message}\n"
+    def release_client(self, client_websocket):
+        """Drop a disconnected client's topic ownership, so its output isn't routed to it"""
+        owned = [topic_name for topic_name, owner in self.topic_owners.items() if owner is client_websocket]
+        for topic_name in owned:
+            del self.topic_owners[topic_name]
             
-            async with aiofiles.open(log_file, 'a') as f:
-                await f.write(log_entry)
-                
-        except Exception as e:
-            logger.error(f"Error logging to topic {topic_name}: {e}")
+    @staticmethod
+    def output_prefix(topic_name: str) -> bytes:
+        """Serialized opening of a topic's output message, up to the first per-message key"""
+        return dumps({"type": "output", "topicName": topic_name})[:-1] + b','
+        
+    async def log_to_topic(self, topic_name: str, message: str):
+        """Queue a message for the topic's log file"""
+        log_entry = f"{log_timestamp()} - {message}\n"
+        self.log_buffers.setdefault(topic_name, []).append(log_entry)
+        
+        # One flusher serves every topic
+        if self.log_flusher is None or self.log_flusher.done():
+            self.log_flusher = asyncio.create_task(self.flush_logs())
+            
+    async def flush_logs(self):
+        """Periodically write buffered log lines"""
+        while True:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+            await self.write_logs()
+            
+    async def write_logs(self):
+        """Append each topic's buffered lines to its log file in one write"""
+        async with self.log_lock:
+            if not self.log_buffers:
+                return
+            buffers, self.log_buffers = self.log_buffers, {}
+            
+            # The worker thread gets its own snapshot of the topic tables and
+            # hands back the files it opened; only the loop mutates them
+            batch = [
+                (topic_name, self.log_paths.get(topic_name), self.log_files.get(topic_name), "".join(lines))
+                for topic_name, lines in buffers.items()
+            ]
+            # All topics in one trip to the thread pool
+            opened = await asyncio.to_thread(self.append_logs, batch)
+            self.log_files.update(opened)
+            
+    @staticmethod
+    def append_logs(batch: List[Tuple[str, Optional[str], Optional[TextIO], str]]) -> Dict[str, TextIO]:
+        """Blocking part of write_logs, run in a worker thread"""
+        opened = {}
+        for topic_name, log_file, f, text in batch:
+            try:
+                if f is None:
+                    if log_file is None:
+                        raise FileNotFoundError(f"no log file for topic {topic_name}")
+                    f = opened[topic_name] = open(log_file, 'a', buffering=LOG_FILE_BUFFERING)
+                f.write(text)
+                f.flush()
+            except OSError as e:
+                logger.error(f"Error logging to topic {topic_name}: {e}")
+        return opened
+        
+    async def close_log(self, topic_name: str):
+        """Write out a topic's pending log lines and close its log file"""
+        # Output can still be logged while a batch is being written; flush
+        # until nothing is pending, so no line is left without a file
+        await self.write_logs()
+        while topic_name in self.log_buffers:
+            await self.write_logs()
+        # No await since the last write_logs returned, so no batch can be
+        # using the file and no line can be buffered for it before the
+        # caller drops the topic
+        f = self.log_files.pop(topic_name, None)
+        if f:
+            f.close()
+        self.log_paths.pop(topic_name, None)
 
 
 class WebSocketRouter:
     """WebSocket router for handling connections and message routing"""
     
     def __init__(self):
+        self.server1_connected = asyncio.Event()  # set while server1_connection is open
         self.server1_connection: Optional[websockets.WebSocketServerProtocol] = None
         self.client_connections: Set[websockets.WebSocketServerProtocol] = set()
+        self.client_queues: Dict[object, asyncio.Queue] = {}  # client websocket -> serialized messages to send
+        self.http_session: Optional[aiohttp.ClientSession] = None  # shared, keeps server-1 connections alive
+        self.server1_queue: asyncio.Queue = asyncio.Queue(maxsize=SERVER1_QUEUE_SIZE)  # serialized messages
+        self.server1_writer: Optional[asyncio.Task] = None
+        self.server1_handlers = {  # server-1 message type -> handler
+            'batch': self._on_batch,
+            'stdout': self._on_stdout,
+            'stdout_batch': self._on_stdout_batch,
+            'session_created': self._on_session_created,
+            'session_destroyed': self._on_session_destroyed,
+        }
+        self.client_handlers = {  # client message type -> handler
+            'create_topic': self._on_create_topic,
+            'stop_topic': self._on_stop_topic,
+            'send_command': self._on_send_command,
+        }
         self.program2: Optional[Program2Interface] = None
         
+    @property
+    def server1_connection(self) -> Optional[websockets.WebSocketServerProtocol]:
+        """Current connection from server-1, if any"""
+        return self._server1_connection
+        
+    @server1_connection.setter
+    def server1_connection(self, websocket: Optional[websockets.WebSocketServerProtocol]):
+        self._server1_connection = websocket
+        if websocket:
+            self.server1_connected.set()
+        else:
+            self.server1_connected.clear()
+            
     def set_program2_interface(self, program2: Program2Interface):
         """Set the Program-2 interface"""
         self.program2 = program2
@@ -178,45 +365,75 @@ class WebSocketRouter:
         try:
             async for message in websocket:
                 await self.handle_server1_message(message)
+            logger.warning("Server-1 disconnected")
         except ConnectionClosed:
             logger.warning("Server-1 disconnected")
-            self.server1_connection = None
         except Exception as e:
             logger.error(f"Error in server-1 connection: {e}")
-            self.server1_connection = None
+        finally:
+            # Server-1 keeps one connection up and reconnects with backoff;
+            # a reconnect may already have replaced this one
+            if self.server1_connection is websocket:
+                self.server1_connection = None
             
-    async def handle_server1_message(self, message: str):
-        """Handle message from server-1"""
+    async def handle_server1_message(self, message: Union[str, bytes]):
+        """Handle message from server-1; binary frames are parsed as is, without decoding to str"""
         try:
-            data = json.loads(message)
-            message_type = data.get('type')
-            
-            if message_type == 'stdout':
-                session_id = data.get('sessionId')
-                output = data.get('data')
-                
-                if session_id and output and self.program2:
-                    await self.program2.handle_session_output(session_id, output)
-                    
-            elif message_type == 'session_created':
-                # Handle session creation response
-                session_id = data.get('sessionId')
-                logger.info(f"Session created: {session_id}")
-                
-            elif message_type == 'session_destroyed':
-                # Handle session destruction response
-                session_id = data.get('sessionId')
-                logger.info(f"Session destroyed: {session_id}")
+            data = loads(message)
+            await self.dispatch_server1_message(data)
                 
         except json.JSONDecodeError:
             logger.error(f"Invalid JSON from server-1: {message}")
         except Exception as e:
             logger.error(f"Error handling server-1 message: {e}")
             
+    async def dispatch_server1_message(self, data: dict):
+        """Handle a single decoded message from server-1"""
+        handler = self.server1_handlers.get(data.get('type'))
+        if handler:
+            await handler(data)
+            
+    async def _on_batch(self, data: dict):
+        """Server-1 coalesces queued messages into one batch message"""
+        for item in data.get('items', []):
+            await self.dispatch_server1_message(item)
+            
+    async def _on_stdout(self, data: dict):
+        """A single chunk of session output"""
+        session_id = data.get('sessionId')
+        output = data.get('data')
+        
+        if session_id and output and self.program2:
+            await self.program2.handle_session_output(session_id, output)
+            
+    async def _on_stdout_batch(self, data: dict):
+        """Several chunks of one session's output"""
+        session_id = data.get('sessionId')
+        
+        if session_id and self.program2:
+            for item in data.get('items', []):
+                output = item.get('data')
+                if output:
+                    await self.program2.handle_session_output(session_id, output)
+                    
+    async def _on_session_created(self, data: dict):
+        """Session creation response"""
+        logger.info(f"Session created: {data.get('sessionId')}")
+        
+    async def _on_session_destroyed(self, data: dict):
+        """Session destroyed by server-1 on its own, e.g. evicted at its session limit"""
+        session_id = data.get('sessionId')
+        logger.info(f"Session destroyed: {session_id}")
+        if session_id and self.program2:
+            await self.program2.handle_session_destroyed(session_id)
+            
     async def handle_client_connection(self, websocket, path):
         """Handle client connections (for Program-2)"""
         logger.info(f"Client connected: {path}")
         self.client_connections.add(websocket)
+        queue = asyncio.Queue()  # output in it is bounded by queue_to_client
+        self.client_queues[websocket] = queue
+        sender = asyncio.create_task(self.write_client_messages(websocket, queue))
         
         try:
             async for message in websocket:
@@ -227,57 +444,102 @@ class WebSocketRouter:
             logger.error(f"Error in client connection: {e}")
         finally:
             self.client_connections.discard(websocket)
+            del self.client_queues[websocket]
+            sender.cancel()
+            if self.program2:
+                self.program2.release_client(websocket)
+            
+    def queue_to_client(self, websocket, message: bytes) -> bool:
+        """Queue a serialized message for a client's sender task; False if the client is gone"""
+        queue = self.client_queues.get(websocket)
+        if queue is None:
+            return False
+            
+        if queue.qsize() >= CLIENT_QUEUE_SIZE and message.startswith(OUTPUT_PREFIX):
+            # Don't hold up server-1's stream for one slow client; the
+            # latest output matters most, so make room by dropping the oldest
+            logger.warning("Client send queue full, dropping oldest output")
+            if not self.drop_oldest_output(queue):
+                return True  # nothing but replies queued, drop this output instead
+                
+        queue.put_nowait(message)
+        return True
+        
+    @staticmethod
+    def drop_oldest_output(queue: asyncio.Queue) -> bool:
+        """Remove the oldest output message from a client queue; replies keep their order"""
+        dropped = False
+        for message in [queue.get_nowait() for _ in range(queue.qsize())]:
+            if not dropped and message.startswith(OUTPUT_PREFIX):
+                dropped = True
+                continue
+            queue.put_nowait(message)
+        return dropped
+        
+    async def write_client_messages(self, websocket, queue: asyncio.Queue):
+        """Single writer for a client: send queued messages, coalescing pending ones"""
+        while True:
+            messages = [await queue.get()]
+            batch_size = len(messages[0])
+            
+            while not queue.empty() and batch_size < CLIENT_BATCH_BYTES:
+                message = queue.get_nowait()
+                messages.append(message)
+                batch_size += len(message)
+                
+            # Messages are serialized JSON objects, joined they make the items array
+            if len(messages) == 1:
+                payload = messages[0]
+            else:
+                payload = BATCH_PREFIX + b",".join(messages) + b"]}"
+                
+            try:
+                await websocket.send(payload)
+            except ConnectionClosed:
+                return
+            except Exception as e:
+                logger.error(f"Failed to send to client: {e}")
             
     async def handle_client_message(self, websocket, message: str):
         """Handle message from client"""
         try:
-            data = json.loads(message)
-            command_type = data.get('type')
-            
-            if command_type == 'create_topic':
-                topic_name = data.get('topicName')
-                user_id = data.get('userId')
-                
-                if topic_name and user_id and self.program2:
-                    success = await self.program2.create_topic(topic_name, user_id, websocket)
-                    response = {
-                        'type': 'topic_created' if success else 'topic_create_failed',
-                        'topicName': topic_name,
-                        'success': success
-                    }
-                    await websocket.send(json.dumps(response))
-                    
-            elif command_type == 'stop_topic':
-                topic_name = data.get('topicName')
-                
-                if topic_name and self.program2:
-                    success = await self.program2.stop_topic(topic_name)
-                    response = {
-                        'type': 'topic_stopped',
-                        'topicName': topic_name,
-                        'success': success
-                    }
-                    await websocket.send(json.dumps(response))
-                    
-            elif command_type == 'send_command':
-                topic_name = data.get('topicName')
-                command = data.get('command')
+            data = loads(message)
+            handler = self.client_handlers.get(data.get('type'))
+            if handler:
+                await handler(websocket, data)
                 
-                if topic_name and command and self.program2:
-                    success = await self.program2.send_command_to_topic(topic_name, command)
-                    response = {
-                        'type': 'command_sent',
-                        'topicName': topic_name,
-                        'command': command,
-                        'success': success
-                    }
-                    await websocket.send(json.dumps(response))
-                    
         except json.JSONDecodeError:
             logger.error(f"Invalid JSON from client: {message}")
         except Exception as e:
             logger.error(f"Error handling client message: {e}")
             
+    async def _on_create_topic(self, websocket, data: dict):
+        """Create a topic owned by this client"""
+        topic_name = data.get('topicName')
+        user_id = data.get('userId')
+        
+        if topic_name and user_id and self.program2:
+            success = await self.program2.create_topic(topic_name, user_id, websocket)
+            reply_type = b'topic_created' if success else b'topic_create_failed'
+            self.queue_to_client(websocket, TOPIC_REPLY % (reply_type, dumps(topic_name), dumps(success)))
+            
+    async def _on_stop_topic(self, websocket, data: dict):
+        """Stop a topic"""
+        topic_name = data.get('topicName')
+        
+        if topic_name and self.program2:
+            success = await self.program2.stop_topic(topic_name)
+            self.queue_to_client(websocket, TOPIC_REPLY % (b'topic_stopped', dumps(topic_name), dumps(success)))
+            
+    async def _on_send_command(self, websocket, data: dict):
+        """Run a command in a topic's session"""
+        topic_name = data.get('topicName')
+        command = data.get('command')
+        
+        if topic_name and command and self.program2:
+            success = await self.program2.send_command_to_topic(topic_name, command)
+            self.queue_to_client(websocket, COMMAND_REPLY % (dumps(topic_name), dumps(command), dumps(success)))
+            
     async def request_session_creation(self, user_id: str) -> Optional[str]:
         """Request session creation from server-1"""
         if not self.server1_connection:
@@ -286,26 +548,37 @@ class WebSocketRouter:
             
         # For this implementation, we'll make HTTP request to server-1
         # In a real implementation, this could be done via WebSocket
-        import aiohttp
-        
         try:
-            async with aiohttp.ClientSession() as session:
-                server1_url = os.getenv('SERVER1_URL', 'http://localhost:8004')
-                async with session.post(
-                    f'{server1_url}/sessions',
-                    json={'user_id': user_id}
-                ) as response:
-                    if response.status == 201:
-                        data = await response.json()
-                        return data.get('session_id')
-                    else:
-                        logger.error(f"Failed to create session: {response.status}")
-                        return None
-                        
+            server1_url = os.getenv('SERVER1_URL', 'http://localhost:8004')
+            async with self.get_http_session().post(
+                f'{server1_url}/sessions',
+                json={'user_id': user_id}
+            ) as response:
+                if response.status == 201:
+                    data = await response.json(loads=loads)
+                    return data.get('session_id')
+                else:
+                    logger.error(f"Failed to create session: {response.status}")
+                    return None
+                    
         except Exception as e:
             logger.error(f"Error requesting session creation: {e}")
             return None
             
+    def get_http_session(self) -> aiohttp.ClientSession:
+        """HTTP client for server-1, created on first use and then reused"""
+        if self.http_session is None or self.http_session.closed:
+            # Idle connections to server-1 outlive aiohttp's 15s default, so
+            # sporadic topic creations still reuse them; server-1 keeps them 75s
+            connector = aiohttp.TCPConnector(keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT)
+            self.http_session = aiohttp.ClientSession(connector=connector)
+        return self.http_session
+        
+    async def close(self):
+        """Release the shared HTTP client"""
+        if self.http_session is not None:
+            await self.http_session.close()
+            
     async def request_session_destruction(self, session_id: str):
         """Request session destruction from server-1"""
         if not self.server1_connection:
@@ -316,13 +589,10 @@ class WebSocketRouter:
         message = {
             'type': 'session_destroy',
             'sessionId': session_id,
-            'timestamp': datetime.now(timezone.utc).isoformat() + 'Z'
+            'timestamp': utc_timestamp()
         }
         
-        try:
-            await self.server1_connection.send(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Error requesting session destruction: {e}")
+        await self.queue_to_server1(message)
             
     async def send_command_to_session(self, session_id: str, command: str):
         """Send command to session via server-1"""
@@ -334,13 +604,51 @@ class WebSocketRouter:
             'type': 'command',
             'sessionId': session_id,
             'data': command,
-            'timestamp': datetime.now(timezone.utc).isoformat() + 'Z'
+            'timestamp': utc_timestamp()
         }
         
-        try:
-            await self.server1_connection.send(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Error sending command to session: {e}")
+        await self.queue_to_server1(message)
+        
+    async def queue_to_server1(self, message: dict):
+        """Queue a message for the server-1 writer task, starting it if needed; waits while the queue is full"""
+        if self.server1_writer is None or self.server1_writer.done():
+            self.server1_writer = asyncio.create_task(self.write_server1_messages())
+            
+        await self.server1_queue.put(dumps(message))
+            
+    async def write_server1_messages(self):
+        """Single writer for server-1: send queued messages in order, coalescing pending ones"""
+        queue = self.server1_queue
+        while True:
+            messages = [await queue.get()]
+            while not queue.empty() and len(messages) < SERVER1_BATCH_ITEMS:
+                messages.append(queue.get_nowait())
+                
+            # Messages are serialized JSON objects, joined they make the items array
+            if len(messages) == 1:
+                payload = messages[0]
+            else:
+                payload = BATCH_PREFIX + b",".join(messages) + b"]}"
+                
+            # While server-1 is disconnected the payload is held here; it
+            # reconnects on its own, and the queue fills up behind it meanwhile
+            try:
+                while True:
+                    await self.server1_connected.wait()
+                    websocket = self.server1_connection
+                    try:
+                        await websocket.send(payload)
+                        break
+                    except ConnectionClosed:
+                        # Resend on the next connection, unless that one is already up
+                        if self.server1_connection is websocket:
+                            self.server1_connection = None
+                    except Exception as e:
+                        logger.error(f"Error sending to server-1: {e}")
+                        break
+            finally:
+                for _ in messages:
+                    queue.task_done()
 
 
 async def start_servers():
@@ -350,8 +658,7 @@ async def start_servers():
     router.set_program2_interface(program2)
     
     # Create data directory (use local directory for testing)
-    data_dir = os.getenv('DATA_DIR', './data')
-    os.makedirs(f"{data_dir}/topics", exist_ok=True)
+    os.makedirs(program2.topics_dir, exist_ok=True)
     
     # Get ports from environment for flexibility
     server1_port = int(os.getenv('SERVER1_WS_PORT', '8003'))
@@ -362,12 +669,19 @@ async def start_servers():
     ping_timeout = int(os.getenv('WS_PING_TIMEOUT', '60'))     # 1 minute default
     
     # Start WebSocket server for server-1 connections
+    # (per-message deflate is off on both, frames are small output batches).
+    # Server-1 sends binary frames, which skip UTF-8 validation; the size
+    # limit leaves room for a coalesced batch of escape-heavy output, since
+    # an oversized frame would close the link
     server1_server = await websockets.serve(
         router.handle_server1_connection,
         '0.0.0.0',
         server1_port,
         ping_interval=ping_interval,
-        ping_timeout=ping_timeout
+        ping_timeout=ping_timeout,
+        compression=None,
+        max_size=SERVER1_MAX_MESSAGE_SIZE,
+        write_limit=WS_WRITE_LIMIT
     )
     
     # Start WebSocket server for client connections
@@ -376,7 +690,9 @@ async def start_servers():
         '0.0.0.0',
         client_port,
         ping_interval=ping_interval,
-        ping_timeout=ping_timeout
+        ping_timeout=ping_timeout,
+        compression=None,
+        write_limit=WS_WRITE_LIMIT
     )
     
     logger.info("Server-2 started:")
@@ -386,13 +702,22 @@ async def start_servers():
     logger.info(f"  - WebSocket ping timeout: {ping_timeout}s")
     
     # Keep servers running
-    await asyncio.gather(
-        server1_server.wait_closed(),
-        client_server.wait_closed()
-    )
+    try:
+        await asyncio.gather(
+            server1_server.wait_closed(),
+            client_server.wait_closed()
+        )
+    finally:
+        await router.close()
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     try:
         asyncio.run(start_servers())
     except KeyboardInterrupt:
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+class StubRouter:
+    """Stand-in for WebSocketRouter that records what Program2Interface asks of it"""
+    
+    def __init__(self, session_id="session_123"):
+        self.session_id = session_id
+        self.created = []          # user ids
+        self.destroyed = []        # session ids
+        self.commands = []         # (session id, command)
+        self.client_messages = []  # (client websocket, serialized message)
+    
+    async def request_session_creation(self, user_id):
+        """Record the request and hand out the configured session id"""
+        self.created.append(user_id)
+        return self.session_id
+    
+    async def request_session_destruction(self, session_id):
+        """Record the destroy request"""
+        self.destroyed.append(session_id)
+    
+    async def send_command_to_session(self, session_id, command):
+        """Record the command"""
+        self.commands.append((session_id, command))
+    
+    def queue_to_client(self, websocket, message):
+        """Record the message; every client counts as connected"""
+        self.client_messages.append((websocket, message))
+        return True
@@ -3,6 +3,7 @@
 import sys
 import os
 import subprocess
+import tempfile
 import unittest
 
 def run_all_tests():
@@ -21,42 +22,43 @@ def run_all_tests():
     if os.path.exists(tmux_mock_script):
         os.chmod(tmux_mock_script, 0o755)
     
-    print("Running Server-1 Tests...")
-    print("=" * 50)
-    
-    # Run server1 tests
-    try:
-        result1 = subprocess.run([
-            sys.executable, 
-            os.path.join(os.path.dirname(__file__), 'test_server1.py')
-        ], capture_output=False)
-    except Exception as e:
-        print(f"Error running server1 tests: {e}")
-        result1 = type('Result', (), {'returncode': 1})()
-    
-    print("\nRunning Server-2 Tests...")
-    print("=" * 50)
-    
-    # Run server2 tests
-    try:
-        result2 = subprocess.run([
-            sys.executable, 
-            os.path.join(os.path.dirname(__file__), 'test_server2.py')
-        ], capture_output=False)
-    except Exception as e:
-        print(f"Error running server2 tests: {e}")
-        result2 = type('Result', (), {'returncode': 1})()
+    # The two suites are independent, run them side by side; output is
+    # captured per suite and printed in order so it doesn't interleave
+    processes = {}
+    for name, test_file in (("Server-1", 'test_server1.py'), ("Server-2", 'test_server2.py')):
+        output = tempfile.TemporaryFile()
+        try:
+            process = subprocess.Popen([
+                sys.executable, 
+                os.path.join(os.path.dirname(__file__), test_file)
+            ], stdout=output, stderr=subprocess.STDOUT)
+        except Exception as e:
+            print(f"Error running {name.lower()} tests: {e}")
+            process = None
+        processes[name] = (process, output)
+        
+    returncodes = {}
+    for index, (name, (process, output)) in enumerate(processes.items()):
+        returncodes[name] = process.wait() if process else 1
+        
+        if index:
+            print()
+        print(f"Running {name} Tests...")
+        print("=" * 50)
+        output.seek(0)
+        sys.stdout.write(output.read().decode(errors='replace'))
+        output.close()
     
     print("\n" + "=" * 50)
     print("Test Summary:")
-    print(f"Server-1 tests: {'PASSED' if result1.returncode == 0 else 'FAILED'}")
-    print(f"Server-2 tests: {'PASSED' if result2.returncode == 0 else 'FAILED'}")
+    for name, returncode in returncodes.items():
+        print(f"{name} tests: {'PASSED' if returncode == 0 else 'FAILED'}")
     
     # Clean up
     if os.path.exists(tmux_mock_path):
         os.remove(tmux_mock_path)
     
-    return result1.returncode == 0 and result2.returncode == 0
+    return all(returncode == 0 for returncode in returncodes.values())
 
 if __name__ == '__main__':
     success = run_all_tests()
@@ -1,33 +1,56 @@
 #!/usr/bin/env python3
 
 import asyncio
+import codecs
 import json
 import os
 import sys
 import unittest
 import tempfile
 import shutil
-from unittest.mock import patch, MagicMock, AsyncMock
+import subprocess
+from subprocess import CalledProcessError
+from unittest.mock import patch, MagicMock, AsyncMock, call
 import aiohttp
 import websockets
+from aiohttp import web
+from websockets.exceptions import ConnectionClosed
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 
 # Add parent directory to path to import server modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server1'))
-from tmux_manager import TmuxSessionManager, TmuxHTTPServer
+from tmux_manager import TmuxSessionManager, TmuxHTTPServer, TmuxControlClient, backoff_delay, flush_delay, utc_timestamp
 
-class TestTmuxSessionManager(unittest.TestCase):
+
+def mock_tmux_process(returncode=0, stdout=b""):
+    """Build a fake asyncio subprocess for a one-shot tmux call"""
+    process = MagicMock()
+    process.returncode = returncode
+    process.communicate = AsyncMock(return_value=(stdout, b""))
+    return process
+
+class TestTmuxSessionManager(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         self.manager = TmuxSessionManager("test_session")
         self.temp_dir = tempfile.mkdtemp()
         
+        # Session directories and output FIFOs go under the temp dir
+        self.sessions_dir_patcher = patch('tmux_manager.SESSIONS_DIR', self.temp_dir)
+        self.sessions_dir_patcher.start()
+        
+    async def asyncTearDown(self):
+        # Close output FIFOs left open by sessions the test created
+        for session_id in self.manager.sessions:
+            self.manager.stop_output_pipe(session_id)
+            
     def tearDown(self):
+        self.sessions_dir_patcher.stop()
         shutil.rmtree(self.temp_dir, ignore_errors=True)
         
-    @patch('subprocess.run')
+    @patch('asyncio.create_subprocess_exec')
     async def test_create_session_success(self, mock_subprocess):
         """Test successful session creation"""
-        mock_subprocess.return_value = MagicMock(returncode=0)
+        mock_subprocess.return_value = mock_tmux_process()
         
         with patch.dict(os.environ, {'PATH': f"{os.path.dirname(__file__)}:{os.environ.get('PATH', '')}"}):
             user_id = "test_user_123"
@@ -39,57 +62,157 @@ class TestTmuxSessionManager(unittest.TestCase):
             # Verify tmux commands were called
             self.assertTrue(mock_subprocess.called)
             
-    @patch('subprocess.run')
+    @patch('asyncio.create_subprocess_exec')
     async def test_create_session_failure(self, mock_subprocess):
         """Test session creation failure"""
-        from subprocess import CalledProcessError
-        mock_subprocess.side_effect = CalledProcessError(1, 'tmux')
+        mock_subprocess.return_value = mock_tmux_process(returncode=1)
         
         user_id = "test_user_123"
         
         with self.assertRaises(Exception):
             await self.manager.create_session(user_id)
             
-    @patch('subprocess.run')
+    async def test_create_session_failure_removes_directory(self):
+        """Test a failed new-window leaves no session directory behind"""
+        with patch.object(self.manager, '_tmux', side_effect=CalledProcessError(1, "tmux")):
+            with self.assertRaises(Exception):
+                await self.manager.create_session("test_user_123")
+                
+        self.assertFalse(self.manager.sessions)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+        
+    @patch('asyncio.create_subprocess_exec')
     async def test_destroy_session_success(self, mock_subprocess):
         """Test successful session destruction"""
-        mock_subprocess.return_value = MagicMock(returncode=0)
+        mock_subprocess.return_value = mock_tmux_process()
         
         # First create a session
         session_id = "test_session_id"
-        self.manager.sessions[session_id] = "test_window"
+        self.manager.sessions[session_id] = self.manager.make_session(session_id, "test_window")
         
         result = await self.manager.destroy_session(session_id)
         
         self.assertTrue(result)
         self.assertNotIn(session_id, self.manager.sessions)
         
+    async def test_destroy_session_kill_failure_keeps_output(self):
+        """Test a failed kill-window leaves the session and its output reader in place"""
+        session_id = "test_session_id"
+        self.manager.sessions[session_id] = self.manager.make_session(session_id, "test_window")
+        
+        with patch.object(self.manager, '_tmux', side_effect=CalledProcessError(1, "tmux")), \
+             patch.object(self.manager, 'stop_output_pipe') as mock_stop:
+            result = await self.manager.destroy_session(session_id)
+            
+        self.assertFalse(result)
+        self.assertIn(session_id, self.manager.sessions)
+        mock_stop.assert_not_called()
+        
+    async def test_create_session_evicts_least_recently_used(self):
+        """Test the least recently used session is destroyed at the session limit"""
+        self.manager.sessions["old_session"] = self.manager.make_session("old_session", "old_window")
+        self.manager.sessions["recent_session"] = self.manager.make_session("recent_session", "recent_window")
+        
+        with patch('tmux_manager.MAX_SESSIONS', 2), \
+             patch.object(self.manager, '_tmux'), \
+             patch.object(self.manager, 'send_command_to_window'), \
+             patch.object(self.manager, 'start_output_pipe'), \
+             patch.object(self.manager, 'destroy_session') as mock_destroy:
+            # Using the older session makes the other one least recently used
+            await self.manager.send_command_to_session("old_session", "ls")
+            await self.manager.create_session("test_user_123")
+            
+            mock_destroy.assert_called_once_with("recent_session")
+            
+            # Server-2 is told the evicted session is gone
+            frame = json.loads(self.manager.ws_queue.get_nowait())
+            self.assertEqual(frame["type"], "session_destroyed")
+            self.assertEqual(frame["sessionId"], "recent_session")
+            
+    async def test_create_session_eviction_failure(self):
+        """Test a failed eviction is logged and server-2 is not told"""
+        self.manager.sessions["old_session"] = self.manager.make_session("old_session", "old_window")
+        
+        with patch('tmux_manager.MAX_SESSIONS', 1), \
+             patch.object(self.manager, '_tmux'), \
+             patch.object(self.manager, 'send_command_to_window'), \
+             patch.object(self.manager, 'start_output_pipe'), \
+             patch.object(self.manager, 'destroy_session', return_value=False), \
+             self.assertLogs('tmux_manager', level='ERROR'):
+            await self.manager.create_session("test_user_123")
+            
+        self.assertTrue(self.manager.ws_queue.empty())
+        
     async def test_destroy_nonexistent_session(self):
         """Test destroying a non-existent session"""
         result = await self.manager.destroy_session("nonexistent_id")
         self.assertFalse(result)
         
-    @patch('subprocess.run')
+    @patch('asyncio.create_subprocess_exec')
     async def test_send_command_to_session(self, mock_subprocess):
         """Test sending command to session"""
-        mock_subprocess.return_value = MagicMock(returncode=0)
+        mock_subprocess.return_value = mock_tmux_process()
         
         session_id = "test_session_id"
         window_name = "test_window"
-        self.manager.sessions[session_id] = window_name
+        self.manager.sessions[session_id] = self.manager.make_session(session_id, window_name)
         
         await self.manager.send_command_to_session(session_id, "echo test")
         
         # Verify tmux send-keys was called
         self.assertTrue(mock_subprocess.called)
-        call_args = mock_subprocess.call_args[0][0]
+        call_args = mock_subprocess.call_args[0]
         self.assertEqual(call_args[0], "tmux")
         self.assertEqual(call_args[1], "send-keys")
         
+    async def test_send_command_batches_while_in_flight(self):
+        """Test commands sent during an in-flight send-keys go out together in the next one"""
+        session_id = "test_session_id"
+        self.manager.sessions[session_id] = self.manager.make_session(session_id, "test_window")
+        release = asyncio.Event()
+        calls = []
+        
+        async def fake_tmux(*args):
+            calls.append(args)
+            await release.wait()
+            return []
+            
+        with patch.object(self.manager, '_tmux', side_effect=fake_tmux):
+            first = asyncio.create_task(self.manager.send_command_to_session(session_id, "cd /tmp"))
+            await asyncio.sleep(0)
+            await self.manager.send_command_to_session(session_id, "ls")
+            await self.manager.send_command_to_session(session_id, "pwd")
+            release.set()
+            await first
+            
+        self.assertEqual(calls, [
+            ("send-keys", "-t", "test_session:test_window", "cd /tmp", "Enter"),
+            ("send-keys", "-t", "test_session:test_window", "ls", "Enter", "pwd", "Enter"),
+        ])
+        self.assertNotIn(session_id, self.manager.pending_commands)
+        
+    async def test_tmux_restarts_lost_control_client(self):
+        """Test a lost control client is replaced instead of forking per command"""
+        self.manager.tmux_ctl = MagicMock(running=False)
+        
+        with patch('tmux_manager.TmuxControlClient') as mock_client_class, \
+             patch('asyncio.create_subprocess_exec') as mock_subprocess:
+            new_client = mock_client_class.return_value
+            new_client.start = AsyncMock()
+            new_client.running = True
+            new_client.command = AsyncMock(return_value=["ok"])
+            
+            result = await self.manager._tmux("list-windows")
+            
+            self.assertEqual(result, ["ok"])
+            self.assertIs(self.manager.tmux_ctl, new_client)
+            new_client.command.assert_called_once_with("list-windows")
+            mock_subprocess.assert_not_called()
+            
     async def test_handle_command(self):
         """Test handling WebSocket commands"""
         session_id = "test_session_id"
-        self.manager.sessions[session_id] = "test_window"
+        self.manager.sessions[session_id] = self.manager.make_session(session_id, "test_window")
         
         with patch.object(self.manager, 'send_command_to_session') as mock_send:
             # Test command handling
@@ -109,13 +232,252 @@ class TestTmuxSessionManager(unittest.TestCase):
             })
             
             mock_destroy.assert_called_once_with(session_id)
+            
+        with patch.object(self.manager, 'send_command_to_session') as mock_send, \
+             patch.object(self.manager, 'destroy_session') as mock_destroy:
+            # Test batched messages are handled in order
+            await self.manager.handle_command({
+                'type': 'batch',
+                'items': [
+                    {'type': 'command', 'sessionId': session_id, 'data': 'ls'},
+                    {'type': 'command', 'sessionId': session_id, 'data': 'pwd'},
+                    {'type': 'session_destroy', 'sessionId': session_id}
+                ]
+            })
+            
+            self.assertEqual(mock_send.call_args_list, [call(session_id, 'ls'), call(session_id, 'pwd')])
+            mock_destroy.assert_called_once_with(session_id)
+            
+    async def test_send_output_to_server2(self):
+        """Test stdout batches are queued for server-2 as JSON bytes frames"""
+        self.manager.websocket = AsyncMock()
+        items = [{"timestamp": "2025-11-24T10:30:00Z", "data": "старт"}]
+        
+        await self.manager.send_output_to_server2("test_session_id", items)
+        
+        sent = self.manager.ws_queue.get_nowait()
+        self.assertIsInstance(sent, bytes)
+        message = json.loads(sent)
+        self.assertEqual(message["type"], "stdout_batch")
+        self.assertEqual(message["sessionId"], "test_session_id")
+        self.assertEqual(message["items"], items)
+        self.assertEqual(message["sequence"], 0)
+        self.assertEqual(self.manager.sequence, 1)
+        
+    async def test_send_output_to_server2_cached_prefix(self):
+        """Test frames built from the cached prefix match a full serialization"""
+        session_id = "test_session_id"
+        self.manager.websocket = AsyncMock()
+        self.manager.frame_prefixes[session_id] = TmuxSessionManager.frame_prefix(session_id)
+        items = [{"timestamp": "2025-11-24T10:30:00Z", "data": 'say "hi"'}]
+        
+        await self.manager.send_output_to_server2(session_id, items)
+        await self.manager.send_output_to_server2(session_id, [])
+        
+        # Empty batches are not sent at all
+        self.assertEqual(self.manager.ws_queue.qsize(), 1)
+        self.assertEqual(json.loads(self.manager.ws_queue.get_nowait()), {
+            "type": "stdout_batch",
+            "sessionId": session_id,
+            "items": items,
+            "sequence": 0
+        })
+        
+    async def test_run_websocket_reconnects_after_close(self):
+        """Test a closed connection is replaced by the same lifecycle task, not a new one"""
+        closed_socket = MagicMock()
+        closed_socket.__aiter__.return_value = []
+        hang = asyncio.Event()
+        connects = []
+        
+        async def fake_connect(*args, **kwargs):
+            connects.append(args)
+            if len(connects) > 1:
+                await hang.wait()
+            return closed_socket
+            
+        with patch('websockets.connect', side_effect=fake_connect), \
+             patch('tmux_manager.backoff_delay', return_value=0):
+            await self.manager.connect_websocket()
+            lifecycle = self.manager.ws_lifecycle
+            await asyncio.sleep(0.01)
+            await self.manager.connect_websocket()
+            
+            self.assertEqual(len(connects), 2)
+            self.assertIs(self.manager.ws_lifecycle, lifecycle)
+            self.assertFalse(self.manager.ws_connected.is_set())
+            lifecycle.cancel()
+            self.manager.ws_writer.cancel()
+            
+    async def test_write_frames_coalesces_pending_frames(self):
+        """Test frames queued together go out as one batch message"""
+        self.manager.websocket = AsyncMock()
+        self.manager.ws_connected.set()
+        self.manager.ws_queue.put_nowait(b'{"type":"stdout_batch","sequence":0}')
+        self.manager.ws_queue.put_nowait(b'{"type":"stdout_batch","sequence":1}')
+        
+        writer = asyncio.create_task(self.manager.write_frames())
+        await asyncio.sleep(0)
+        writer.cancel()
+        
+        self.manager.websocket.send.assert_called_once()
+        sent = json.loads(self.manager.websocket.send.call_args[0][0])
+        self.assertEqual(sent["type"], "batch")
+        self.assertEqual([message["sequence"] for message in sent["items"]], [0, 1])
+        
+    async def test_write_frames_resends_after_reconnect(self):
+        """Test a frame that hit a closed connection is sent again once reconnected"""
+        closed_websocket = AsyncMock()
+        closed_websocket.send.side_effect = ConnectionClosed(None, None)
+        self.manager.websocket = closed_websocket
+        self.manager.ws_connected.set()
+        self.manager.ws_queue.put_nowait(b'{"type":"stdout_batch","sequence":0}')
+        
+        writer = asyncio.create_task(self.manager.write_frames())
+        await asyncio.sleep(0)
+        self.assertFalse(self.manager.ws_connected.is_set())
+        
+        # Reconnect
+        self.manager.websocket = AsyncMock()
+        self.manager.ws_connected.set()
+        await asyncio.sleep(0)
+        writer.cancel()
+        
+        self.manager.websocket.send.assert_called_once_with(b'{"type":"stdout_batch","sequence":0}')
+        
+    async def test_flush_output_batches_pending_chunks(self):
+        """Test queued output chunks are coalesced and decoded into a single send"""
+        session_id = "test_session_id"
+        self.manager.output_queues[session_id] = asyncio.Queue()
+        self.manager.output_decoders[session_id] = codecs.getincrementaldecoder('utf-8')()
+        
+        # A multi-byte character split across two reads must survive intact
+        encoded = "старт\r\n".encode()
+        for chunk in (encoded[:1], encoded[1:], b"line 2\r\n"):
+            self.manager.output_queues[session_id].put_nowait(chunk)
+        self.manager.dirty_outputs.add(session_id)
+        self.manager.output_ready.set()
+            
+        with patch.object(self.manager, 'send_output_to_server2') as mock_send, \
+             patch('tmux_manager.OUTPUT_FLUSH_MIN_DELAY', 0):
+            flusher = asyncio.create_task(self.manager.flush_output())
+            await asyncio.sleep(0.01)
+            flusher.cancel()
+            
+            mock_send.assert_called_once()
+            self.assertEqual(mock_send.call_args[0][0], session_id)
+            items = mock_send.call_args[0][1]
+            self.assertEqual([item["data"] for item in items], ["старт\r\nline 2"])
+            self.assertFalse(self.manager.dirty_outputs)
+            
+    def test_flush_delay(self):
+        """Test the output flush wait grows with the server-2 backlog, up to the cap"""
+        self.assertAlmostEqual(flush_delay(0), 0.02)
+        self.assertAlmostEqual(flush_delay(10), 0.12)
+        self.assertEqual(flush_delay(1000), 0.5)
+        
+    def test_backoff_delay(self):
+        """Test reconnect delays grow exponentially up to the cap, plus jitter"""
+        for attempt, base in ((0, 1), (3, 8), (10, 60)):
+            delay = backoff_delay(attempt)
+            self.assertGreaterEqual(delay, base)
+            self.assertLess(delay, base + 1)
+            
+    def test_utc_timestamp(self):
+        """Test timestamps are ISO 8601 UTC and reused within a millisecond"""
+        with patch('time.time_ns', return_value=1764000000123456789):
+            timestamp = utc_timestamp()
+            self.assertEqual(timestamp, "2025-11-24T16:00:00.123Z")
+            self.assertIs(utc_timestamp(), timestamp)
+            
+    async def test_read_session_output(self):
+        """Test piped output is queued as raw bytes and the session marked for flushing"""
+        session_id = "test_session_id"
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        self.manager.output_queues[session_id] = asyncio.Queue()
+        self.manager.output_pipes[session_id] = (read_fd, write_fd)
+        
+        try:
+            os.write(write_fd, "старт\r\n".encode())
+            self.manager.read_session_output(session_id)
+            # Nothing left to read, nothing queued
+            self.manager.read_session_output(session_id)
+            
+            queue = self.manager.output_queues[session_id]
+            self.assertEqual(queue.qsize(), 1)
+            self.assertEqual(queue.get_nowait(), "старт\r\n".encode())
+            self.assertIn(session_id, self.manager.dirty_outputs)
+            self.assertTrue(self.manager.output_ready.is_set())
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
 
+class TestTmuxControlClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = TmuxControlClient("test_session")
+        
+    def attach_fake_process(self):
+        """Attach a fake control-mode process with a feedable stdout"""
+        process = MagicMock()
+        process.returncode = None
+        process.stdin.drain = AsyncMock()
+        process.stdout = asyncio.StreamReader()
+        self.client.process = process
+        self.client.reader_task = asyncio.create_task(self.client.read_replies())
+        return process
+        
+    async def test_command_reply(self):
+        """Test a command resolves with the lines of its reply block"""
+        process = self.attach_fake_process()
+        
+        # The initial attach block (flag 0) must not be taken as a reply
+        process.stdout.feed_data(b"%begin 1 1 0\n%end 1 1 0\n%session-changed $0 test_session\n")
+        command = asyncio.create_task(self.client.command("list-windows"))
+        await asyncio.sleep(0)
+        process.stdout.feed_data(b"%begin 1 2 1\n0: bash* (1 panes)\n%end 1 2 1\n")
+        
+        self.assertEqual(await command, ["0: bash* (1 panes)"])
+        process.stdin.write.assert_called_once_with(b'"list-windows"\n')
+        
+    async def test_command_error(self):
+        """Test an %error reply raises CalledProcessError"""
+        process = self.attach_fake_process()
+        
+        command = asyncio.create_task(self.client.command("kill-window", "-t", "test_session:nope"))
+        await asyncio.sleep(0)
+        process.stdout.feed_data(b"%begin 1 3 1\ncan't find window: nope\n%error 1 3 1\n")
+        
+        with self.assertRaises(CalledProcessError):
+            await command
+            
+    async def test_reply_without_pending_command(self):
+        """Test a reply nobody waits for is skipped and the reader keeps going"""
+        process = self.attach_fake_process()
+        
+        process.stdout.feed_data(b"%begin 1 5 1\n%end 1 5 1\n")
+        await asyncio.sleep(0)
+        command = asyncio.create_task(self.client.command("list-windows"))
+        await asyncio.sleep(0)
+        process.stdout.feed_data(b"%begin 1 6 1\n0: bash* (1 panes)\n%end 1 6 1\n")
+        
+        self.assertEqual(await command, ["0: bash* (1 panes)"])
+        self.assertFalse(self.client.reader_task.done())
+        
+    async def test_command_quoting(self):
+        """Test arguments are quoted for the tmux parser"""
+        process = self.attach_fake_process()
+        
+        command = asyncio.create_task(self.client.command("send-keys", 'echo "$HOME"; ls', "Enter"))
+        await asyncio.sleep(0)
+        process.stdout.feed_data(b"%begin 1 4 1\n%end 1 4 1\n")
+        await command
+        
+        process.stdin.write.assert_called_once_with(b'"send-keys" "echo \\"\\$HOME\\"; ls" "Enter"\n')
 
 class TestTmuxHTTPServer(AioHTTPTestCase):
     async def get_application(self):
         """Create test application"""
-        from aiohttp import web
-        
         self.tmux_manager = TmuxSessionManager("test_session")
         self.http_server = TmuxHTTPServer(self.tmux_manager)
         
@@ -171,13 +533,14 @@ class TestTmuxHTTPServer(AioHTTPTestCase):
     @unittest_run_loop
     async def test_delete_session_success(self):
         """Test successful session deletion"""
-        with patch.object(self.tmux_manager, 'destroy_session', return_value=True):
+        with patch.object(self.tmux_manager, 'destroy_session', return_value=True) as mock_destroy:
             resp = await self.client.request(
                 "DELETE", 
                 "/sessions/test_session_123"
             )
             
             self.assertEqual(resp.status, 204)
+            mock_destroy.assert_called_once_with("test_session_123")
             
     @unittest_run_loop
     async def test_delete_session_not_found(self):
@@ -191,7 +554,7 @@ class TestTmuxHTTPServer(AioHTTPTestCase):
             self.assertEqual(resp.status, 404)
 
 
-class TestTmuxIntegration(unittest.TestCase):
+class TestTmuxIntegration(unittest.IsolatedAsyncioTestCase):
     """Integration tests using the tmux mock"""
     
     def setUp(self):
@@ -208,9 +571,26 @@ class TestTmuxIntegration(unittest.TestCase):
             with open(tmux_mock_path, 'w') as f:
                 f.write(f'#!/bin/bash\npython3 {tmux_mock_script} "$@"\n')
             os.chmod(tmux_mock_path, 0o755)
+            
+        # The mock keeps its sessions and windows in a state file between
+        # invocations; the manager runs inside an existing tmux session
+        os.environ['TMUX_MOCK_STATE'] = f"{self.test_dir}/tmux_state.json"
+        subprocess.run(["tmux", "new-session", "-d", "-s", "integration_test"], check=True)
         
+        # Session directories and output FIFOs go under the temp dir
+        self.sessions_dir_patcher = patch('tmux_manager.SESSIONS_DIR', self.test_dir)
+        self.sessions_dir_patcher.start()
+        self.manager = TmuxSessionManager("integration_test")
+        
+    async def asyncTearDown(self):
+        # Destroy sessions a failed test left behind, while the mock is still on PATH
+        for session_id in list(self.manager.sessions):
+            await self.manager.destroy_session(session_id)
+            
     def tearDown(self):
+        self.sessions_dir_patcher.stop()
         os.environ['PATH'] = self.original_path
+        os.environ.pop('TMUX_MOCK_STATE', None)
         shutil.rmtree(self.test_dir, ignore_errors=True)
         
         # Clean up tmux mock
@@ -220,10 +600,10 @@ class TestTmuxIntegration(unittest.TestCase):
             
     async def test_full_session_lifecycle(self):
         """Test complete session lifecycle with tmux mock"""
-        manager = TmuxSessionManager("integration_test")
+        manager = self.manager
         
         # Start the manager (this will try to create tmux session)
-        with patch('websockets.connect'):  # Mock websocket connection
+        with patch('websockets.connect', new_callable=AsyncMock):  # Mock websocket connection
             await manager.start()
         
         # Create a session
@@ -250,6 +630,7 @@ if __name__ == '__main__':
     
     # Add test cases
     suite.addTests(loader.loadTestsFromTestCase(TestTmuxSessionManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestTmuxControlClient))
     suite.addTests(loader.loadTestsFromTestCase(TestTmuxHTTPServer))
     suite.addTests(loader.loadTestsFromTestCase(TestTmuxIntegration))
     
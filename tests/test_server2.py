@@ -6,16 +6,17 @@ import os
 import sys
 import unittest
 import tempfile
+import time
 import shutil
-from unittest.mock import patch, MagicMock, AsyncMock
+from unittest.mock import patch, MagicMock, AsyncMock, call
 import websockets
-import aiofiles
 
 # Add parent directory to path to import server modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server2'))
-from websocket_server import WebSocketRouter, Program2Interface
+from websocket_server import WebSocketRouter, Program2Interface, utc_timestamp, log_timestamp
+from router_stub import StubRouter
 
-class TestProgram2Interface(unittest.TestCase):
+class TestProgram2Interface(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         self.mock_router = MagicMock()
         self.mock_router.request_session_creation = AsyncMock()
@@ -23,7 +24,6 @@ class TestProgram2Interface(unittest.TestCase):
         self.mock_router.send_command_to_session = AsyncMock()
         
         self.program2 = Program2Interface(self.mock_router)
-        self.test_dir = tempfile.mkdtemp()
         
         # Patch the data directory
         self.data_dir_patcher = patch('websocket_server.os.makedirs')
@@ -31,7 +31,6 @@ class TestProgram2Interface(unittest.TestCase):
         
     def tearDown(self):
         self.data_dir_patcher.stop()
-        shutil.rmtree(self.test_dir, ignore_errors=True)
         
     async def test_create_topic_success(self):
         """Test successful topic creation"""
@@ -45,6 +44,8 @@ class TestProgram2Interface(unittest.TestCase):
             self.assertTrue(result)
             self.assertIn("test_topic", self.program2.topics)
             self.assertEqual(self.program2.topics["test_topic"], "session_123")
+            self.assertEqual(self.program2.sessions["session_123"], "test_topic")
+            self.assertTrue(self.program2.log_paths["test_topic"].endswith("/topics/test_topic/test_topic.log"))
             
             # Verify session creation was requested
             self.mock_router.request_session_creation.assert_called_once_with("user_123")
@@ -52,6 +53,18 @@ class TestProgram2Interface(unittest.TestCase):
             # Verify logging
             mock_log.assert_called_once_with("test_topic", "session opened - session_123")
             
+    async def test_create_topic_reuses_known_directory(self):
+        """Test a topic directory is created only the first time its name is used"""
+        self.mock_router.request_session_creation.return_value = "session_123"
+        
+        with patch('websocket_server.os.makedirs') as mock_makedirs, \
+             patch.object(self.program2, 'log_to_topic'):
+            await self.program2.create_topic("test_topic", "user_123")
+            await self.program2.stop_topic("test_topic")
+            await self.program2.create_topic("test_topic", "user_123")
+            
+            mock_makedirs.assert_called_once()
+            
     async def test_create_topic_session_failure(self):
         """Test topic creation when session creation fails"""
         self.mock_router.request_session_creation.return_value = None
@@ -66,12 +79,14 @@ class TestProgram2Interface(unittest.TestCase):
         """Test successful topic stopping"""
         # Setup existing topic
         self.program2.topics["test_topic"] = "session_123"
+        self.program2.sessions["session_123"] = "test_topic"
         
         with patch.object(self.program2, 'log_to_topic') as mock_log:
             result = await self.program2.stop_topic("test_topic")
             
             self.assertTrue(result)
             self.assertNotIn("test_topic", self.program2.topics)
+            self.assertNotIn("session_123", self.program2.sessions)
             
             # Verify session destruction was requested
             self.mock_router.request_session_destruction.assert_called_once_with("session_123")
@@ -79,6 +94,26 @@ class TestProgram2Interface(unittest.TestCase):
             # Verify logging
             mock_log.assert_called_once_with("test_topic", "стоп")
             
+    async def test_handle_session_destroyed(self):
+        """Test a session destroyed by server-1 stops its topic and tells the owner"""
+        owner = object()
+        self.program2.topics["test_topic"] = "session_123"
+        self.program2.sessions["session_123"] = "test_topic"
+        self.program2.topic_owners["test_topic"] = owner
+        
+        with patch.object(self.program2, 'log_to_topic') as mock_log:
+            await self.program2.handle_session_destroyed("session_123")
+            
+        self.assertNotIn("test_topic", self.program2.topics)
+        self.assertNotIn("session_123", self.program2.sessions)
+        self.assertNotIn("test_topic", self.program2.topic_owners)
+        mock_log.assert_called_once_with("test_topic", "стоп")
+        self.mock_router.request_session_destruction.assert_not_called()
+        
+        client, message = self.mock_router.queue_to_client.call_args[0]
+        self.assertIs(client, owner)
+        self.assertEqual(json.loads(message), {"type": "topic_stopped", "topicName": "test_topic", "success": True})
+        
     async def test_stop_topic_not_found(self):
         """Test stopping non-existent topic"""
         result = await self.program2.stop_topic("nonexistent_topic")
@@ -104,6 +139,7 @@ class TestProgram2Interface(unittest.TestCase):
         """Test handling session output"""
         # Setup existing topic
         self.program2.topics["test_topic"] = "session_123"
+        self.program2.sessions["session_123"] = "test_topic"
         
         with patch.object(self.program2, 'log_to_topic') as mock_log:
             await self.program2.handle_session_output("session_123", "command output")
@@ -111,6 +147,31 @@ class TestProgram2Interface(unittest.TestCase):
             # Verify logging
             mock_log.assert_called_once_with("test_topic", "OUTPUT: command output")
             
+    async def test_send_output_to_owner(self):
+        """Test output messages are built from the topic's cached prefix"""
+        owner = AsyncMock()
+        self.program2.topic_owners["test_topic"] = owner
+        self.program2.output_prefixes["test_topic"] = Program2Interface.output_prefix("test_topic")
+        
+        await self.program2.send_output_to_owner("test_topic", 'say "hi"\n')
+        
+        owner_arg, message = self.mock_router.queue_to_client.call_args[0]
+        self.assertIs(owner_arg, owner)
+        sent_message = json.loads(message)
+        self.assertEqual(sent_message["type"], "output")
+        self.assertEqual(sent_message["topicName"], "test_topic")
+        self.assertEqual(sent_message["data"], 'say "hi"\n')
+        self.assertIn("timestamp", sent_message)
+        
+    def test_release_client(self):
+        """Test a disconnected client loses only the topics it owned"""
+        client, other_client = MagicMock(), MagicMock()
+        self.program2.topic_owners.update({"topic_a": client, "topic_b": other_client, "topic_c": client})
+        
+        self.program2.release_client(client)
+        
+        self.assertEqual(self.program2.topic_owners, {"topic_b": other_client})
+        
     async def test_handle_session_output_unknown_session(self):
         """Test handling output from unknown session"""
         with patch.object(self.program2, 'log_to_topic') as mock_log:
@@ -120,27 +181,91 @@ class TestProgram2Interface(unittest.TestCase):
             mock_log.assert_not_called()
             
     async def test_log_to_topic(self):
-        """Test logging to topic file"""
-        with patch('aiofiles.open', create=True) as mock_open:
-            mock_file = AsyncMock()
-            mock_open.return_value.__aenter__.return_value = mock_file
-            
-            await self.program2.log_to_topic("test_topic", "test message")
-            
-            # Verify file was opened and written to
-            mock_open.assert_called_once_with("/data/topics/test_topic/test_topic.log", 'a')
-            mock_file.write.assert_called_once()
-            
-            # Check that timestamp and message are in the written content
-            written_content = mock_file.write.call_args[0][0]
-            self.assertIn("test message", written_content)
-            self.assertIn(" - ", written_content)  # Timestamp separator
+        """Test log lines are buffered and appended to the topic's open log file together"""
+        # Only this test touches the filesystem; setUp stubs out os.makedirs
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir, ignore_errors=True)
+        os.mkdir(f"{test_dir}/topics")
+        os.mkdir(f"{test_dir}/topics/test_topic")
+        
+        self.program2.log_paths["test_topic"] = f"{test_dir}/topics/test_topic/test_topic.log"
+        await self.program2.log_to_topic("test_topic", "test message")
+        await self.program2.log_to_topic("test_topic", "second message")
+        self.program2.log_flusher.cancel()
+        
+        # Nothing is written until the buffers are flushed
+        self.assertIn("test_topic", self.program2.log_buffers)
+        await self.program2.write_logs()
+        self.assertFalse(self.program2.log_buffers)
+        
+        # The file stays open for later batches until the topic's log is closed
+        log_file = self.program2.log_files["test_topic"]
+        await self.program2.close_log("test_topic")
+        self.assertTrue(log_file.closed)
+        self.assertNotIn("test_topic", self.program2.log_files)
+        
+        with open(f"{test_dir}/topics/test_topic/test_topic.log") as f:
+            lines = f.read().splitlines()
+            
+        # Check that timestamp and message are in the written content
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(" - test message"))
+        self.assertTrue(lines[1].endswith(" - second message"))
 
+        
+    async def test_stop_topic_keeps_output_logged_during_close(self):
+        """Test output that arrives while the last log batch is written still reaches the file"""
+        # Only this test touches the filesystem; setUp stubs out os.makedirs
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir, ignore_errors=True)
+        log_path = f"{test_dir}/t1.log"
+        self.program2.topics["t1"] = "session_123"
+        self.program2.sessions["session_123"] = "t1"
+        self.program2.log_paths["t1"] = log_path
+        
+        def slow_append_logs(batch):
+            time.sleep(0.05)
+            return Program2Interface.append_logs(batch)
+            
+        with patch.object(self.program2, 'append_logs', side_effect=slow_append_logs):
+            stop = asyncio.create_task(self.program2.stop_topic("t1"))
+            await asyncio.sleep(0.01)
+            await self.program2.handle_session_output("session_123", "late")
+            self.assertTrue(await stop)
+        self.program2.log_flusher.cancel()
+        
+        with open(log_path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[0].endswith(" - стоп"))
+        self.assertTrue(lines[1].endswith(" - OUTPUT: late"))
+        self.assertFalse(self.program2.log_buffers)
+        
+    async def test_log_file_opened_once(self):
+        """Test later log batches reuse the topic's open file"""
+        self.program2.log_paths["test_topic"] = "/data/topics/test_topic/test_topic.log"
+        
+        with patch('builtins.open') as mock_open:
+            for message in ("first", "second", "third"):
+                await self.program2.log_to_topic("test_topic", message)
+                await self.program2.write_logs()
+            self.program2.log_flusher.cancel()
+            
+            mock_open.assert_called_once_with("/data/topics/test_topic/test_topic.log", 'a', buffering=65536)
+            self.assertEqual(mock_open.return_value.write.call_count, 3)
 
-class TestWebSocketRouter(unittest.TestCase):
+class TestWebSocketRouter(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         self.router = WebSocketRouter()
         
+    @staticmethod
+    def mock_http_session(status, body=None):
+        """aiohttp session stub whose POST responds with the given status and JSON body"""
+        mock_session = MagicMock(closed=False)
+        mock_response = mock_session.post.return_value.__aenter__.return_value = AsyncMock()
+        mock_response.status = status
+        mock_response.json.return_value = body
+        return mock_session
+        
     async def test_handle_server1_message_stdout(self):
         """Test handling stdout message from server-1"""
         mock_program2 = AsyncMock()
@@ -158,6 +283,69 @@ class TestWebSocketRouter(unittest.TestCase):
         # Verify output was handled
         mock_program2.handle_session_output.assert_called_once_with("session_123", "test output")
         
+    async def test_handle_server1_message_binary(self):
+        """Test a binary frame from server-1 is parsed without decoding it first"""
+        mock_program2 = AsyncMock()
+        self.router.set_program2_interface(mock_program2)
+        
+        message = '{"type":"stdout","sessionId":"session_123","data":"\\u001b[32mготово\\u001b[0m"}'.encode()
+        
+        await self.router.handle_server1_message(message)
+        
+        mock_program2.handle_session_output.assert_called_once_with("session_123", "\x1b[32mготово\x1b[0m")
+        
+    async def test_handle_server1_message_stdout_batch(self):
+        """Test handling batched stdout message from server-1"""
+        mock_program2 = AsyncMock()
+        self.router.set_program2_interface(mock_program2)
+        
+        message = json.dumps({
+            "type": "stdout_batch",
+            "sessionId": "session_123",
+            "items": [
+                {"timestamp": "2025-11-24T10:30:00Z", "data": "first"},
+                {"timestamp": "2025-11-24T10:30:01Z", "data": "second"}
+            ],
+            "sequence": 0
+        })
+        
+        await self.router.handle_server1_message(message)
+        
+        # Verify every item was handled in order
+        self.assertEqual(mock_program2.handle_session_output.call_args_list, [
+            call("session_123", "first"),
+            call("session_123", "second")
+        ])
+        
+    async def test_handle_server1_message_session_destroyed(self):
+        """Test a session_destroyed message from server-1 reaches Program-2"""
+        mock_program2 = AsyncMock()
+        self.router.set_program2_interface(mock_program2)
+        
+        await self.router.handle_server1_message('{"type":"session_destroyed","sessionId":"session_123"}')
+        
+        mock_program2.handle_session_destroyed.assert_called_once_with("session_123")
+        
+    async def test_handle_server1_message_batch(self):
+        """Test handling a batch of coalesced messages from server-1"""
+        mock_program2 = AsyncMock()
+        self.router.set_program2_interface(mock_program2)
+        
+        message = json.dumps({
+            "type": "batch",
+            "items": [
+                {"type": "stdout_batch", "sessionId": "session_123", "items": [{"data": "first"}], "sequence": 0},
+                {"type": "stdout_batch", "sessionId": "session_456", "items": [{"data": "second"}], "sequence": 1}
+            ]
+        })
+        
+        await self.router.handle_server1_message(message)
+        
+        self.assertEqual(mock_program2.handle_session_output.call_args_list, [
+            call("session_123", "first"),
+            call("session_456", "second")
+        ])
+        
     async def test_handle_server1_message_invalid_json(self):
         """Test handling invalid JSON from server-1"""
         # Should not raise exception
@@ -166,6 +354,7 @@ class TestWebSocketRouter(unittest.TestCase):
     async def test_handle_client_message_create_topic(self):
         """Test handling create topic message from client"""
         mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
         mock_program2 = AsyncMock()
         mock_program2.create_topic.return_value = True
         self.router.set_program2_interface(mock_program2)
@@ -179,11 +368,11 @@ class TestWebSocketRouter(unittest.TestCase):
         await self.router.handle_client_message(mock_websocket, message)
         
         # Verify topic creation was called
-        mock_program2.create_topic.assert_called_once_with("test_topic", "user_123")
+        mock_program2.create_topic.assert_called_once_with("test_topic", "user_123", mock_websocket)
         
-        # Verify response was sent
-        mock_websocket.send.assert_called_once()
-        sent_message = json.loads(mock_websocket.send.call_args[0][0])
+        # Verify the reply was queued for the client's sender
+        self.assertEqual(queue.qsize(), 1)
+        sent_message = json.loads(queue.get_nowait())
         self.assertEqual(sent_message["type"], "topic_created")
         self.assertEqual(sent_message["topicName"], "test_topic")
         self.assertTrue(sent_message["success"])
@@ -191,6 +380,7 @@ class TestWebSocketRouter(unittest.TestCase):
     async def test_handle_client_message_stop_topic(self):
         """Test handling stop topic message from client"""
         mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
         mock_program2 = AsyncMock()
         mock_program2.stop_topic.return_value = True
         self.router.set_program2_interface(mock_program2)
@@ -205,14 +395,15 @@ class TestWebSocketRouter(unittest.TestCase):
         # Verify topic stopping was called
         mock_program2.stop_topic.assert_called_once_with("test_topic")
         
-        # Verify response was sent
-        mock_websocket.send.assert_called_once()
-        sent_message = json.loads(mock_websocket.send.call_args[0][0])
+        # Verify the reply was queued for the client's sender
+        self.assertEqual(queue.qsize(), 1)
+        sent_message = json.loads(queue.get_nowait())
         self.assertEqual(sent_message["type"], "topic_stopped")
         
     async def test_handle_client_message_send_command(self):
         """Test handling send command message from client"""
         mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
         mock_program2 = AsyncMock()
         mock_program2.send_command_to_topic.return_value = True
         self.router.set_program2_interface(mock_program2)
@@ -223,48 +414,66 @@ class TestWebSocketRouter(unittest.TestCase):
             "command": "ls -la"
         })
         
+        # Output already queued for the client goes out first
+        self.router.queue_to_client(mock_websocket, b'{"type":"output","data":"earlier"}')
         await self.router.handle_client_message(mock_websocket, message)
         
         # Verify command was sent
         mock_program2.send_command_to_topic.assert_called_once_with("test_topic", "ls -la")
         
-        # Verify response was sent
-        mock_websocket.send.assert_called_once()
-        sent_message = json.loads(mock_websocket.send.call_args[0][0])
+        # Verify the reply was queued behind the earlier output
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(json.loads(queue.get_nowait())["data"], "earlier")
+        sent_message = json.loads(queue.get_nowait())
         self.assertEqual(sent_message["type"], "command_sent")
         self.assertEqual(sent_message["command"], "ls -la")
         
+    async def test_handle_client_message_create_topic_failed(self):
+        """Test the failure reply escapes the topic name"""
+        mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
+        mock_program2 = AsyncMock()
+        mock_program2.create_topic.return_value = False
+        self.router.set_program2_interface(mock_program2)
+        
+        message = json.dumps({
+            "type": "create_topic",
+            "topicName": 'топик "1"',
+            "userId": "user_123"
+        })
+        
+        await self.router.handle_client_message(mock_websocket, message)
+        
+        sent_message = json.loads(queue.get_nowait())
+        self.assertEqual(sent_message, {"type": "topic_create_failed", "topicName": 'топик "1"', "success": False})
+        
     async def test_request_session_creation_success(self):
         """Test successful session creation request"""
-        with patch('aiohttp.ClientSession') as mock_session_class:
-            mock_session = AsyncMock()
-            mock_response = AsyncMock()
-            mock_response.status = 201
-            mock_response.json.return_value = {"session_id": "session_123"}
-            
-            mock_session.__aenter__.return_value = mock_session
-            mock_session.post.return_value.__aenter__.return_value = mock_response
-            mock_session_class.return_value = mock_session
-            
+        self.router.server1_connection = AsyncMock()
+        
+        mock_session = self.mock_http_session(201, {"session_id": "session_123"})
+        
+        with patch('aiohttp.ClientSession', return_value=mock_session) as mock_session_class, \
+             patch('aiohttp.TCPConnector') as mock_connector_class, \
+             patch.dict(os.environ, {'SERVER1_URL': 'http://server1:8001'}):
             result = await self.router.request_session_creation("user_123")
+            # The HTTP client is shared across requests
+            await self.router.request_session_creation("user_456")
+            mock_session_class.assert_called_once()
+            mock_connector_class.assert_called_once_with(keepalive_timeout=60)
             
             self.assertEqual(result, "session_123")
-            mock_session.post.assert_called_once_with(
+            self.assertEqual(mock_session.post.call_args_list[0], call(
                 'http://server1:8001/sessions',
                 json={'user_id': 'user_123'}
-            )
+            ))
             
     async def test_request_session_creation_failure(self):
         """Test failed session creation request"""
-        with patch('aiohttp.ClientSession') as mock_session_class:
-            mock_session = AsyncMock()
-            mock_response = AsyncMock()
-            mock_response.status = 422
-            
-            mock_session.__aenter__.return_value = mock_session
-            mock_session.post.return_value.__aenter__.return_value = mock_response
-            mock_session_class.return_value = mock_session
-            
+        self.router.server1_connection = AsyncMock()
+        
+        with patch('aiohttp.ClientSession', return_value=self.mock_http_session(422)), \
+             patch('aiohttp.TCPConnector'):
             result = await self.router.request_session_creation("user_123")
             
             self.assertIsNone(result)
@@ -275,6 +484,7 @@ class TestWebSocketRouter(unittest.TestCase):
         self.router.server1_connection = mock_websocket
         
         await self.router.send_command_to_session("session_123", "test command")
+        await self.router.server1_queue.join()
         
         # Verify message was sent
         mock_websocket.send.assert_called_once()
@@ -283,6 +493,57 @@ class TestWebSocketRouter(unittest.TestCase):
         self.assertEqual(sent_message["sessionId"], "session_123")
         self.assertEqual(sent_message["data"], "test command")
         
+    async def test_server1_messages_coalesced(self):
+        """Test messages queued for server-1 during a send go out as one batch message"""
+        mock_websocket = AsyncMock()
+        self.router.server1_connection = mock_websocket
+        
+        await self.router.send_command_to_session("session_123", "cd /tmp")
+        await self.router.send_command_to_session("session_123", "ls")
+        await self.router.request_session_destruction("session_123")
+        await self.router.server1_queue.join()
+        
+        mock_websocket.send.assert_called_once()
+        sent_message = json.loads(mock_websocket.send.call_args[0][0])
+        self.assertEqual(sent_message["type"], "batch")
+        self.assertEqual([item["type"] for item in sent_message["items"]], ["command", "command", "session_destroy"])
+        self.assertEqual([item.get("data") for item in sent_message["items"]], ["cd /tmp", "ls", None])
+        
+    async def test_server1_messages_held_until_reconnect(self):
+        """Test a message whose send hits a closed connection goes out on the next one"""
+        old_websocket = AsyncMock()
+        old_websocket.send.side_effect = websockets.exceptions.ConnectionClosed(None, None)
+        self.router.server1_connection = old_websocket
+        
+        await self.router.send_command_to_session("session_123", "ls")
+        await asyncio.sleep(0)
+        self.assertIsNone(self.router.server1_connection)
+        old_websocket.send.assert_called_once()
+        
+        new_websocket = AsyncMock()
+        self.router.server1_connection = new_websocket
+        await self.router.server1_queue.join()
+        
+        new_websocket.send.assert_called_once()
+        self.assertEqual(json.loads(new_websocket.send.call_args[0][0])["data"], "ls")
+        
+    async def test_server1_connection_cleared_on_close(self):
+        """Test a cleanly closed server-1 connection is dropped, unless a reconnect replaced it"""
+        old_websocket = MagicMock()
+        old_websocket.__aiter__.return_value = []
+        await self.router.handle_server1_connection(old_websocket, "/ws")
+        self.assertIsNone(self.router.server1_connection)
+        
+        new_websocket = MagicMock()
+        
+        async def reconnect_while_open(message):
+            self.router.server1_connection = new_websocket
+            
+        old_websocket.__aiter__.return_value = ['{"type":"session_created","sessionId":"session_123"}']
+        with patch.object(self.router, 'handle_server1_message', side_effect=reconnect_while_open):
+            await self.router.handle_server1_connection(old_websocket, "/ws")
+        self.assertIs(self.router.server1_connection, new_websocket)
+        
     async def test_send_command_to_session_no_connection(self):
         """Test sending command when no server-1 connection"""
         self.router.server1_connection = None
@@ -290,43 +551,123 @@ class TestWebSocketRouter(unittest.TestCase):
         # Should not raise exception
         await self.router.send_command_to_session("session_123", "test command")
 
+        
+    async def test_write_client_messages_coalesces_pending(self):
+        """Test messages queued for a client go out as one batch message"""
+        mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
+        
+        self.assertTrue(self.router.queue_to_client(mock_websocket, b'{"type":"output","data":"one"}'))
+        self.assertTrue(self.router.queue_to_client(mock_websocket, b'{"type":"output","data":"two"}'))
+        
+        sender = asyncio.create_task(self.router.write_client_messages(mock_websocket, queue))
+        await asyncio.sleep(0)
+        sender.cancel()
+        
+        mock_websocket.send.assert_called_once()
+        sent_message = json.loads(mock_websocket.send.call_args[0][0])
+        self.assertEqual(sent_message["type"], "batch")
+        self.assertEqual([item["data"] for item in sent_message["items"]], ["one", "two"])
+        
+    @patch('websocket_server.CLIENT_QUEUE_SIZE', 2)
+    async def test_client_queue_overflow_drops_oldest(self):
+        """Test a full client queue makes room for new output by dropping the oldest"""
+        mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
+        
+        for data in ("one", "two", "three"):
+            self.assertTrue(self.router.queue_to_client(mock_websocket, Program2Interface.output_prefix("t") + f'"data":"{data}"}}'.encode()))
+            
+        self.assertEqual([json.loads(queue.get_nowait())["data"] for _ in range(queue.qsize())], ["two", "three"])
+        
+    @patch('websocket_server.CLIENT_QUEUE_SIZE', 2)
+    async def test_client_queue_overflow_keeps_replies(self):
+        """Test replies queued behind a full output backlog are never dropped"""
+        mock_websocket = AsyncMock()
+        self.router.client_queues[mock_websocket] = queue = asyncio.Queue()
+        prefix = Program2Interface.output_prefix("t")
+        
+        self.router.queue_to_client(mock_websocket, prefix + b'"data":"one"}')
+        self.router.queue_to_client(mock_websocket, prefix + b'"data":"two"}')
+        self.router.queue_to_client(mock_websocket, b'{"type":"command_sent","topicName":"t","command":"ls","success":true}')
+        self.router.queue_to_client(mock_websocket, prefix + b'"data":"three"}')
+        self.router.queue_to_client(mock_websocket, prefix + b'"data":"four"}')
+        
+        sent = [json.loads(queue.get_nowait()) for _ in range(queue.qsize())]
+        self.assertEqual([message.get("data", message["type"]) for message in sent], ["command_sent", "three", "four"])
+        
+    async def test_server1_queue_full_waits(self):
+        """Test commands wait for room in a full server-1 queue instead of being dropped"""
+        mock_websocket = AsyncMock()
+        self.router.server1_connection = mock_websocket
+        self.router.server1_queue = asyncio.Queue(maxsize=1)
+        
+        await asyncio.gather(*(
+            self.router.send_command_to_session("session_123", command) for command in ("one", "two", "three")
+        ))
+        await self.router.server1_queue.join()
+        
+        sent = [json.loads(args[0]) for args, _ in mock_websocket.send.call_args_list]
+        self.assertEqual([message["data"] for message in sent], ["one", "two", "three"])
+        
+    async def test_queue_to_disconnected_client(self):
+        """Test queueing for a client without a sender reports it as gone"""
+        self.assertFalse(self.router.queue_to_client(AsyncMock(), b'{"type":"output"}'))
+
+class TestTimestamps(unittest.TestCase):
+    def test_utc_timestamp(self):
+        """Test timestamps are ISO 8601 UTC and reused within a millisecond"""
+        with patch('time.time_ns', return_value=1764000000123456789):
+            timestamp = utc_timestamp()
+            self.assertEqual(timestamp, "2025-11-24T16:00:00.123Z")
+            self.assertIs(utc_timestamp(), timestamp)
+            
+    def test_log_timestamp(self):
+        """Test log timestamps are formatted once per second"""
+        with patch('time.time', return_value=1764000000.25):
+            timestamp = log_timestamp()
+            self.assertRegex(timestamp, r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+            self.assertIs(log_timestamp(), timestamp)
+
 
-class TestIntegrationWorkflow(unittest.TestCase):
+class TestIntegrationWorkflow(unittest.IsolatedAsyncioTestCase):
     """Integration test for complete workflow"""
     
     async def test_complete_topic_workflow(self):
         """Test complete workflow: create topic, send command, get output, stop topic"""
         
-        # Setup
-        router = WebSocketRouter()
+        # Setup; the router stub records requests in plain lists
+        router = StubRouter("session_123")
         program2 = Program2Interface(router)
-        router.set_program2_interface(program2)
+        client = object()
         
         # Mock dependencies
         with patch('websocket_server.os.makedirs'), \
-             patch.object(program2, 'log_to_topic') as mock_log, \
-             patch.object(router, 'request_session_creation', return_value="session_123") as mock_create, \
-             patch.object(router, 'send_command_to_session') as mock_send_cmd, \
-             patch.object(router, 'request_session_destruction') as mock_destroy:
+             patch.object(program2, 'log_to_topic') as mock_log:
             
             # 1. Create topic
-            result = await program2.create_topic("integration_topic", "user_123")
+            result = await program2.create_topic("integration_topic", "user_123", client)
             self.assertTrue(result)
             self.assertIn("integration_topic", program2.topics)
+            self.assertEqual(router.created, ["user_123"])
             
             # 2. Send command
             result = await program2.send_command_to_topic("integration_topic", "echo hello")
             self.assertTrue(result)
-            mock_send_cmd.assert_called_with("session_123", "echo hello")
+            self.assertEqual(router.commands, [("session_123", "echo hello")])
             
-            # 3. Handle output
+            # 3. Handle output; it goes to the owner only
             await program2.handle_session_output("session_123", "hello")
+            self.assertEqual(len(router.client_messages), 1)
+            owner, message = router.client_messages[0]
+            self.assertIs(owner, client)
+            self.assertEqual(json.loads(message)["data"], "hello")
             
             # 4. Stop topic
             result = await program2.stop_topic("integration_topic")
             self.assertTrue(result)
             self.assertNotIn("integration_topic", program2.topics)
-            mock_destroy.assert_called_with("session_123")
+            self.assertEqual(router.destroyed, ["session_123"])
             
             # Verify all logging calls
             expected_logs = [
@@ -351,6 +692,7 @@ if __name__ == '__main__':
     # Add test cases
     suite.addTests(loader.loadTestsFromTestCase(TestProgram2Interface))
     suite.addTests(loader.loadTestsFromTestCase(TestWebSocketRouter))
+    suite.addTests(loader.loadTestsFromTestCase(TestTimestamps))
     suite.addTests(loader.loadTestsFromTestCase(TestIntegrationWorkflow))
     
     # Run tests
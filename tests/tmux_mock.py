@@ -2,6 +2,7 @@
 
 import os
 import sys
+import json
 import time
 import random
 import signal
@@ -10,9 +11,20 @@ from pathlib import Path
 class TmuxMock:
     """Mock tmux implementation for testing that generates dynamic responses"""
     
-    def __init__(self):
+    # Flags that consume the following argument as their value
+    VALUE_FLAGS = frozenset(("-t", "-s", "-n"))
+    
+    def __init__(self, state_file=None):
+        # Each tmux invocation is a fresh process; with a state file,
+        # sessions and windows carry over from one invocation to the next
+        self.state_file = state_file
         self.sessions = {}
         self.windows = {}
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            self.sessions = state['sessions']
+            self.windows = state['windows']
         self.window_outputs = {}
         self.command_responses = {
             'echo "старт"': 'старт',
@@ -25,6 +37,12 @@ class TmuxMock:
             'df -h': 'Filesystem      Size  Used Avail Use% Mounted on\n/dev/disk1s1   465Gi  123Gi  340Gi  27% /',
         }
         
+    def save(self):
+        """Write sessions and windows back to the state file, if there is one"""
+        if self.state_file:
+            with open(self.state_file, 'w') as f:
+                json.dump({'sessions': self.sessions, 'windows': self.windows}, f)
+                
     def run_command(self, args):
         """Main entry point for tmux mock commands"""
         if len(args) < 2:
@@ -47,19 +65,31 @@ class TmuxMock:
         else:
             return f"tmux: unknown command: {command}"
             
+    @classmethod
+    def _parse(cls, args):
+        """Split arguments into flag values and positional arguments in one pass"""
+        opts = {}
+        positional = []
+        it = iter(args)
+        for arg in it:
+            if arg in cls.VALUE_FLAGS:
+                opts[arg] = next(it, None)
+            else:
+                positional.append(arg)
+        return opts, positional
+        
     def has_session(self, args):
         """Check if session exists"""
-        if "-t" in args:
-            session_name = args[args.index("-t") + 1]
-            if session_name not in self.sessions:
-                sys.exit(1)  # Session doesn't exist
+        opts, _ = self._parse(args)
+        session_name = opts.get("-t")
+        if session_name is not None and session_name not in self.sessions:
+            sys.exit(1)  # Session doesn't exist
         return ""
         
     def new_session(self, args):
         """Create new tmux session"""
-        session_name = "default"
-        if "-s" in args:
-            session_name = args[args.index("-s") + 1]
+        opts, _ = self._parse(args)
+        session_name = opts.get("-s") or "default"
             
         self.sessions[session_name] = {
             'windows': [],
@@ -69,13 +99,9 @@ class TmuxMock:
         
     def new_window(self, args):
         """Create new tmux window"""
-        session_name = "default"
-        window_name = f"window-{len(self.windows)}"
-        
-        if "-t" in args:
-            session_name = args[args.index("-t") + 1]
-        if "-n" in args:
-            window_name = args[args.index("-n") + 1]
+        opts, _ = self._parse(args)
+        session_name = opts.get("-t") or "default"
+        window_name = opts.get("-n") or f"window-{len(self.windows)}"
             
         if session_name not in self.sessions:
             sys.exit(1)  # Session doesn't exist
@@ -94,11 +120,10 @@ class TmuxMock:
         
     def send_keys(self, args):
         """Send keys to tmux window"""
-        if "-t" not in args:
+        opts, command_parts = self._parse(args)
+        target = opts.get("-t")
+        if target is None:
             return "tmux: no target specified"
-            
-        target = args[args.index("-t") + 1]
-        command_parts = args[args.index("-t") + 2:]
         
         # Remove "Enter" if present
         if command_parts and command_parts[-1] == "Enter":
@@ -121,10 +146,9 @@ class TmuxMock:
         
     def capture_pane(self, args):
         """Capture pane content"""
-        if "-t" not in args:
+        target = self._parse(args)[0].get("-t")
+        if target is None:
             return "tmux: no target specified"
-            
-        target = args[args.index("-t") + 1]
         
         if target not in self.windows:
             return ""
@@ -138,10 +162,9 @@ class TmuxMock:
         
     def kill_window(self, args):
         """Kill tmux window"""
-        if "-t" not in args:
+        target = self._parse(args)[0].get("-t")
+        if target is None:
             return "tmux: no target specified"
-            
-        target = args[args.index("-t") + 1]
         
         if target in self.windows:
             session_name = self.windows[target]['session']
@@ -168,66 +191,92 @@ class TmuxMock:
                 return response()
             return response
             
-        # Pattern matches
-        if command.startswith('echo'):
-            # Echo back the content
-            content = command[4:].strip().strip('"').strip("'")
-            return content
-            
-        elif command.startswith('ls'):
-            # Generate random file listing
-            files = ['README.md', 'config.json', 'data.txt', 'script.py', 'test_dir/']
-            return '  '.join(random.sample(files, random.randint(2, len(files))))
-            
-        elif command.startswith('cat'):
-            # Generate file content
-            filename = command.split()[-1] if len(command.split()) > 1 else 'file'
-            return f"Content of {filename}:\nLine 1 of content\nLine 2 of content\nEnd of file"
-            
-        elif command.startswith('grep'):
-            return "match found in line 42: example content"
-            
-        elif command == 'uptime':
-            return f"up {random.randint(1, 100)} days, {random.randint(1, 24)} hours"
-            
-        elif command in ['clear', 'cls']:
-            # Clear doesn't produce output
-            return ""
-            
-        elif command.startswith('mkdir'):
-            dirname = command.split()[-1] if len(command.split()) > 1 else 'newdir'
-            return f"Directory '{dirname}' created"
-            
-        elif command.startswith('rm'):
-            return "Files removed"
-            
-        elif command.startswith('cp'):
-            return "Files copied"
-            
-        elif command.startswith('mv'):
-            return "Files moved"
-            
-        elif command.startswith('find'):
-            return "./file1.txt\n./subdir/file2.txt\n./another/file3.log"
-            
-        elif command == 'help' or command == '--help':
-            return "Available commands: ls, pwd, date, echo, cat, etc."
-            
-        else:
-            # Generic response for unknown commands
-            responses = [
-                f"Command '{command}' executed successfully",
-                f"Output from '{command}':\nResult line 1\nResult line 2",
-                f"Processing '{command}'...\nDone.",
-                f"'{command}' completed with exit code 0",
-                f"Running '{command}'...\nOperation successful"
-            ]
-            return random.choice(responses)
-
+        verb = command.split(None, 1)[0] if command else ''
+        return self._VERB_TABLE.get(verb, TmuxMock._generic_response)(self, command)
+        
+    def _echo_response(self, command):
+        """Echo back the content"""
+        return command[4:].strip().strip('"').strip("'")
+        
+    def _ls_response(self, command):
+        """Generate random file listing"""
+        files = ['README.md', 'config.json', 'data.txt', 'script.py', 'test_dir/']
+        return '  '.join(random.sample(files, random.randint(2, len(files))))
+        
+    def _cat_response(self, command):
+        """Generate file content"""
+        filename = command.split()[-1] if len(command.split()) > 1 else 'file'
+        return f"Content of {filename}:\nLine 1 of content\nLine 2 of content\nEnd of file"
+        
+    def _grep_response(self, command):
+        """Generate a grep match"""
+        return "match found in line 42: example content"
+        
+    def _uptime_response(self, command):
+        """Generate a random uptime"""
+        return f"up {random.randint(1, 100)} days, {random.randint(1, 24)} hours"
+        
+    def _clear_response(self, command):
+        """Clear doesn't produce output"""
+        return ""
+        
+    def _mkdir_response(self, command):
+        """Report the created directory"""
+        dirname = command.split()[-1] if len(command.split()) > 1 else 'newdir'
+        return f"Directory '{dirname}' created"
+        
+    def _rm_response(self, command):
+        """Report removed files"""
+        return "Files removed"
+        
+    def _cp_response(self, command):
+        """Report copied files"""
+        return "Files copied"
+        
+    def _mv_response(self, command):
+        """Report moved files"""
+        return "Files moved"
+        
+    def _find_response(self, command):
+        """Generate a find listing"""
+        return "./file1.txt\n./subdir/file2.txt\n./another/file3.log"
+        
+    def _help_response(self, command):
+        """List available commands"""
+        return "Available commands: ls, pwd, date, echo, cat, etc."
+        
+    def _generic_response(self, command):
+        """Generic response for unknown commands"""
+        responses = [
+            f"Command '{command}' executed successfully",
+            f"Output from '{command}':\nResult line 1\nResult line 2",
+            f"Processing '{command}'...\nDone.",
+            f"'{command}' completed with exit code 0",
+            f"Running '{command}'...\nOperation successful"
+        ]
+        return random.choice(responses)
+        
+    # Pattern responses keyed by the first word of the command
+    _VERB_TABLE = {
+        'echo': _echo_response,
+        'ls': _ls_response,
+        'cat': _cat_response,
+        'grep': _grep_response,
+        'uptime': _uptime_response,
+        'clear': _clear_response,
+        'cls': _clear_response,
+        'mkdir': _mkdir_response,
+        'rm': _rm_response,
+        'cp': _cp_response,
+        'mv': _mv_response,
+        'find': _find_response,
+        'help': _help_response,
+        '--help': _help_response,
+    }
 
 def main():
     """Main entry point for tmux mock"""
-    mock = TmuxMock()
+    mock = TmuxMock(os.environ.get('TMUX_MOCK_STATE'))
     
     # Handle signal for graceful shutdown
     def signal_handler(signum, frame):
@@ -238,6 +287,7 @@ def main():
     
     try:
         result = mock.run_command(sys.argv)
+        mock.save()
         if result:
             print(result, end='')
     except SystemExit: